@@ -37,6 +37,14 @@
 """
 单例模式实现方法
 """
+
+import collections
+import os
+import sys
+import threading
+import time
+import weakref
+
 print '----------------------------------------------------------------------------------------------------'
 """
 [方法1][共享实例]
@@ -222,11 +230,657 @@ class My_Singleton(object):
 my_singleton = My_Singleton()
 """
 
-# 在当前模块文件中使用
-from mysingleton import my_singleton
-my_singleton.foo()
-# 4473651024
-from mysingleton import my_singleton
-my_singleton.foo()
-# 4473651024
+# 在当前模块文件中使用(mysingleton.py 不在本仓库中，找不到时跳过，不影响后面的方法)
+try:
+    from mysingleton import my_singleton
+    my_singleton.foo()
+    # 4473651024
+    from mysingleton import my_singleton
+    my_singleton.foo()
+    # 4473651024
+except ImportError as e:
+    print 'skip:', e
+print '----------------------------------------------------------------------------------------------------'
+"""
+[方法6][__metaclass__ + 双重检查锁]
+方法4的线程安全版本，
+方法4中 if cls._instance is None 的判断没有加锁，多个线程可能同时通过判断，导致构造函数被执行多次；
+双重检查锁(Double-Checked Locking):
+    实例已创建时，只读取一次类属性，不加锁(快速路径)；
+    实例未创建时，获取该类自己的锁，并在锁内再次检查，保证构造函数只执行一次。
+"""
+
+class Singleton_meta_threadsafe(type):
+    def __init__(cls, name, bases, dict):
+        super(Singleton_meta_threadsafe, cls).__init__(name, bases, dict)
+        cls._instance = None
+        cls._instance_lock = threading.Lock()  # 每个类一把锁
+    def __call__(cls, *args, **kwargs):
+        instance = cls._instance
+        if instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = super(Singleton_meta_threadsafe, cls).__call__(*args, **kwargs)
+                instance = cls._instance
+        return instance
+
+class MyClass6(object):
+    __metaclass__ = Singleton_meta_threadsafe
+
+a = MyClass6()
+b = MyClass6()
+
+print a, id(a)
+print b, id(b)
+# <__main__.MyClass6 object at 0x7f9409a9a9d0> 140273794001360
+# <__main__.MyClass6 object at 0x7f9409a9a9d0> 140273794001360
+
+"""
+并发测试:
+N 个线程同时调用 cls()，统计每秒调用次数，以及构造函数实际执行的次数。
+构造函数中 sleep 模拟耗时的初始化，放大竞争窗口。
+"""
+
+def make_slow_class(metaclass):
+    class Slow(object):
+        __metaclass__ = metaclass
+        init_count = 0
+        def __init__(self):
+            time.sleep(0.01)
+            type(self).init_count += 1
+    Slow.__name__ = 'Slow_' + metaclass.__name__
+    return Slow
+
+def bench_singleton(cls, n_threads=8, n_calls=20000):
+    start_event = threading.Event()
+    def worker():
+        start_event.wait()
+        for _ in xrange(n_calls):
+            cls()
+    threads = [threading.Thread(target=worker) for _ in xrange(n_threads)]
+    for t in threads:
+        t.start()
+    start = time.time()
+    start_event.set()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    calls_per_sec = n_threads * n_calls / elapsed
+    print '%-36s threads=%d calls/sec=%10.0f init_count=%s' % (
+        cls.__name__, n_threads, calls_per_sec, getattr(cls, 'init_count', '-'))
+
+for n_threads in (1, 8):
+    bench_singleton(MyClass4, n_threads)
+    bench_singleton(MyClass6, n_threads)
+    bench_singleton(make_slow_class(Singleton_meta), n_threads)
+    bench_singleton(make_slow_class(Singleton_meta_threadsafe), n_threads)
+# MyClass4                             threads=1 calls/sec=   3792833 init_count=-
+# MyClass6                             threads=1 calls/sec=   4286463 init_count=-
+# Slow_Singleton_meta                  threads=1 calls/sec=   1230994 init_count=1
+# Slow_Singleton_meta_threadsafe       threads=1 calls/sec=   1327038 init_count=1
+# MyClass4                             threads=8 calls/sec=   3485686 init_count=-
+# MyClass6                             threads=8 calls/sec=   3320117 init_count=-
+# Slow_Singleton_meta                  threads=8 calls/sec=   2450910 init_count=8
+# Slow_Singleton_meta_threadsafe       threads=8 calls/sec=   2423254 init_count=1
+print '----------------------------------------------------------------------------------------------------'
+"""
+[方法7][fork 感知的单例注册表]
+以上各方法都不知道进程边界:
+主进程 fork 出子进程后，子进程会继承父进程中的单例实例，以及其中的 socket、锁等资源。
+由一个中心注册表统一管理单例，并在 fork 之后(子进程中)按每个类声明的策略处理已有实例:
+    FORK_SHARE   子进程直接沿用父进程的实例(预热成本只在父进程支付一次)；
+    FORK_RESET   子进程沿用父进程的实例，但调用其 reset_after_fork() 重建 socket、锁等进程私有资源；
+    FORK_REBUILD 子进程丢弃父进程的实例，在第一次访问时重新创建。
+Python 3.7+ 通过 os.register_at_fork 在 fork 后立即处理；
+没有该接口时(如 Python 2)，在每次访问注册表时比较 os.getpid() 来检测 fork。
+"""
+
+FORK_SHARE = 'share'
+FORK_RESET = 'reset'
+FORK_REBUILD = 'rebuild'
+
+class Singleton_registry(object):
+    def __init__(self):
+        self._instances = {}
+        self._policies = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+    def register(self, cls, on_fork=FORK_SHARE):
+        if on_fork not in (FORK_SHARE, FORK_RESET, FORK_REBUILD):
+            raise ValueError('unknown fork policy: %r' % (on_fork,))
+        if on_fork == FORK_RESET and not callable(getattr(cls, 'reset_after_fork', None)):
+            raise TypeError('%s uses FORK_RESET but does not define reset_after_fork()' % cls.__name__)
+        self._policies[cls] = on_fork
+        return cls
+    def get(self, cls, create, *args, **kwargs):
+        if self._pid != os.getpid():
+            self._after_fork()
+        instance = self._instances.get(cls)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(cls)
+                if instance is None:
+                    instance = self._instances[cls] = create(*args, **kwargs)
+        return instance
+    def _after_fork(self):
+        # 子进程中只有当前一个线程，父进程中的锁可能处于被持有状态，必须重建
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        for cls, instance in list(self._instances.items()):
+            policy = self._policies.get(cls, FORK_SHARE)
+            if policy == FORK_REBUILD:
+                del self._instances[cls]
+            elif policy == FORK_RESET:
+                instance.reset_after_fork()
+
+singleton_registry = Singleton_registry()
+
+class Singleton_meta_forkaware(type):
+    def __init__(cls, name, bases, dict):
+        super(Singleton_meta_forkaware, cls).__init__(name, bases, dict)
+        singleton_registry.register(cls, getattr(cls, 'on_fork', FORK_SHARE))  # 子类继承父类的策略
+    def __call__(cls, *args, **kwargs):
+        return singleton_registry.get(cls, super(Singleton_meta_forkaware, cls).__call__, *args, **kwargs)
+
+class MyClass7_share(object):
+    __metaclass__ = Singleton_meta_forkaware
+    on_fork = FORK_SHARE
+    def __init__(self):
+        self.pid = os.getpid()
+
+class MyClass7_reset(object):
+    __metaclass__ = Singleton_meta_forkaware
+    on_fork = FORK_RESET
+    def __init__(self):
+        self.pid = os.getpid()
+        self.conn_pid = os.getpid()  # 模拟 socket 等进程私有资源
+    def reset_after_fork(self):
+        self.conn_pid = os.getpid()
+
+class MyClass7_rebuild(object):
+    __metaclass__ = Singleton_meta_forkaware
+    on_fork = FORK_REBUILD
+    def __init__(self):
+        self.pid = os.getpid()
+
+class MyClass7_rebuild_sub(MyClass7_rebuild):
+    pass
+
+print singleton_registry._policies[MyClass7_rebuild_sub]
+# rebuild
+try:
+    class MyClass7_reset_without_hook(object):
+        __metaclass__ = Singleton_meta_forkaware
+        on_fork = FORK_RESET
+except TypeError as e:
+    print 'TypeError:', e
+# TypeError: MyClass7_reset_without_hook uses FORK_RESET but does not define reset_after_fork()
+
+def show_fork_singletons(who):
+    for cls in (MyClass7_share, MyClass7_reset, MyClass7_rebuild):
+        a = cls()
+        line = '%s %s id=%d built_in=%s' % (who, cls.__name__, id(a), 'self' if a.pid == os.getpid() else 'parent')
+        if hasattr(a, 'conn_pid'):
+            line += ' conn=%s' % ('self' if a.conn_pid == os.getpid() else 'parent')
+        print line
+
+if hasattr(os, 'fork'):  # 没有 fork 的平台(如 Windows)上跳过，不影响后面的示例
+    show_fork_singletons('parent')
+    sys.stdout.flush()  # 避免缓冲区中的内容在子进程中被重复输出
+    pid = os.fork()
+    if pid == 0:
+        show_fork_singletons('child ')
+        sys.stdout.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+# parent MyClass7_share id=140173520307088 built_in=self
+# parent MyClass7_reset id=140173520307152 built_in=self conn=self
+# parent MyClass7_rebuild id=140173520307216 built_in=self
+# child  MyClass7_share id=140173520307088 built_in=parent
+# child  MyClass7_reset id=140173520307152 built_in=parent conn=self
+# child  MyClass7_rebuild id=140173520307344 built_in=self
+print '----------------------------------------------------------------------------------------------------'
+"""
+[方法8][多例(Multiton)装饰器]
+方法3的 singleton 装饰器每个类只保存一个实例，并且忽略调用参数；
+多例模式为每一组不同的调用参数保存一个实例，例如每个 host 一个连接对象。
+    maxsize 限制缓存的实例个数，超出时按 LRU(最近最少使用)淘汰，None 表示不限制；
+    weak=True 时额外用弱引用记录实例，被淘汰但仍被外部引用的实例，再次访问时返回的仍是同一个对象；
+    hits/misses/evictions 统计命中、未命中、淘汰次数，clear() 清空缓存。
+查找与淘汰都是 O(1)。
+实例在锁外构造，同一个 key 同时只有一个线程在构造，其他线程等待它的结果；不同 key 的查找和构造互不阻塞。
+"""
+
+_kwd_mark = object()  # 分隔位置参数与关键字参数，避免 f(1, ('a', 2)) 与 f(1, a=2) 的 key 相同
+
+class Multiton(object):
+    def __init__(self, cls, maxsize=128, weak=False):
+        if weak and getattr(cls, '__weakrefoffset__', None) == 0:
+            raise TypeError('%s does not support weak references (add __weakref__ to __slots__)' % cls.__name__)
+        self.cls = cls
+        self.maxsize = maxsize
+        self._lru = collections.OrderedDict()
+        self._weak = weakref.WeakValueDictionary() if weak else None
+        self._lock = threading.Lock()
+        self._building = {}  # key -> (Event, 正在构造的线程)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    def _lookup(self, key):
+        # 调用者需持有 self._lock
+        instance = self._lru.pop(key, None)
+        if instance is None and self._weak is not None:
+            instance = self._weak.get(key)
+        if instance is not None:
+            self._insert(key, instance)
+        return instance
+    def _insert(self, key, instance):
+        # 调用者需持有 self._lock
+        self._lru[key] = instance  # 重新插入到末尾，即最近使用
+        if self.maxsize is not None and len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+    def __call__(self, *args, **kwargs):
+        key = args
+        if kwargs:
+            key += (_kwd_mark,) + tuple(sorted(kwargs.items()))
+        current = threading.current_thread()
+        while True:
+            with self._lock:
+                instance = self._lookup(key)
+                if instance is not None:
+                    self.hits += 1
+                    return instance
+                building = self._building.get(key)
+                if building is None:
+                    building = self._building[key] = (threading.Event(), current)
+                    break
+            if building[1] is current:
+                raise RuntimeError('recursive construction of %s%r' % (self.cls.__name__, key))
+            building[0].wait()  # 同一个 key 正在由其他线程构造，等待后重新查找(构造失败时由当前线程重试)
+        # 在锁外构造，构造缓慢时不阻塞其他 key 的查找，构造函数中也可以再次调用同一个多例
+        instance = None
+        try:
+            try:
+                instance = self.cls(*args, **kwargs)
+            finally:
+                with self._lock:
+                    del self._building[key]
+                    if instance is not None:
+                        self.misses += 1
+                        if self._weak is not None:
+                            self._weak[key] = instance
+                        self._insert(key, instance)
+        finally:
+            building[0].set()  # 无论如何都要唤醒等待同一个 key 的线程
+        return instance
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            if self._weak is not None:
+                self._weak.clear()
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._lru)}
+
+def multiton(maxsize=128, weak=False):
+    def _multiton(cls):
+        return Multiton(cls, maxsize, weak)
+    return _multiton
+
+@multiton(maxsize=2)
+class Connection(object):
+    def __init__(self, host, port=80):
+        self.host = host
+        self.port = port
+
+a = Connection('a.com')
+b = Connection('a.com')
+c = Connection('b.com', port=8080)
+print a is b, a is c
+# True False
+Connection('c.com')  # 超出 maxsize=2，淘汰最近最少使用的 a.com
+print Connection('a.com') is a, Connection.stats()
+# False {'hits': 1, 'evictions': 2, 'misses': 4, 'size': 2}
+
+@multiton(maxsize=1, weak=True)
+class Connection_weak(object):
+    def __init__(self, host, port=80):
+        self.host = host
+        self.port = port
+
+a = Connection_weak('a.com')
+Connection_weak('b.com')  # a.com 被 LRU 淘汰，但 a 仍被引用，弱引用中仍然可以找到
+print Connection_weak('a.com') is a, Connection_weak.stats()
+# True {'hits': 1, 'evictions': 2, 'misses': 2, 'size': 1}
+Connection_weak.clear()
+print Connection_weak('a.com') is a, Connection_weak.stats()
+# False {'hits': 1, 'evictions': 2, 'misses': 3, 'size': 1}
+
+try:
+    @multiton(weak=True)
+    class Connection_slots(object):
+        __slots__ = ('host',)
+        def __init__(self, host):
+            self.host = host
+except TypeError as e:
+    print 'TypeError:', e
+# TypeError: Connection_slots does not support weak references (add __weakref__ to __slots__)
+
+@multiton(maxsize=None)
+class Connection_slow(object):
+    def __init__(self, host):
+        self.host = host
+        if host == 'slow.com':
+            time.sleep(0.2)
+        elif host == 'proxy.com':
+            self.upstream = Connection_slow('a.com')  # 构造函数中再次调用同一个多例
+
+Connection_slow('a.com')
+slow_thread = threading.Thread(target=Connection_slow, args=('slow.com',))
+slow_thread.start()
+time.sleep(0.01)
+start = time.time()
+proxy = Connection_slow('proxy.com')
+print proxy.upstream is Connection_slow('a.com'), time.time() - start < 0.1
+# True True
+slow_thread.join()
+print '----------------------------------------------------------------------------------------------------'
+"""
+[方法9][单飞(single-flight)初始化]
+单例持有的资源初始化成本很高时(例如服务启动时建立连接池)，大量并发调用会同时等待(或同时触发)初始化。
+Cls.instance() 保证初始化只执行一次:
+    第一个调用者执行初始化，其余并发调用者等待同一个"进行中"的初始化结果，而不是各自重复初始化；
+    初始化失败时，异常传递给本轮所有等待者，但不被缓存，下一次调用会重新尝试初始化。
+原需求基于 asyncio，本仓库的示例运行在 Python 2 上，这里以线程 + Event 实现相同的语义。
+"""
+
+class _Flight(object):
+    """
+    一次进行中的初始化
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Singleton_meta_singleflight(type):
+    def __init__(cls, name, bases, dict):
+        super(Singleton_meta_singleflight, cls).__init__(name, bases, dict)
+        cls._instance = None
+        cls._flight = None
+        cls._flight_lock = threading.Lock()
+    def instance(cls, *args, **kwargs):
+        instance = cls._instance
+        if instance is not None:
+            return instance
+        with cls._flight_lock:
+            if cls._instance is not None:
+                return cls._instance
+            flight = cls._flight
+            leader = flight is None
+            if leader:
+                flight = cls._flight = _Flight()
+        if leader:
+            try:
+                flight.result = cls._instance = cls(*args, **kwargs)
+            except BaseException:  # 包括 KeyboardInterrupt 等，否则等待者会拿到 None
+                flight.error = sys.exc_info()
+                raise
+            finally:
+                with cls._flight_lock:
+                    cls._flight = None
+                flight.done.set()
+            return flight.result
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error[0], flight.error[1], flight.error[2]
+        return flight.result
+
+class MyClass9(object):
+    __metaclass__ = Singleton_meta_singleflight
+    init_count = 0
+    def __init__(self):
+        MyClass9.init_count += 1
+        time.sleep(0.05)  # 模拟耗时的初始化
+        if MyClass9.init_count == 1:
+            raise IOError('connection refused')  # 第一次初始化失败
+
+def call_instance_concurrently(cls, n_threads=8):
+    results = []
+    def worker():
+        try:
+            results.append(id(cls.instance()))
+        except IOError as e:
+            results.append(repr(e))
+    threads = [threading.Thread(target=worker) for _ in xrange(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(set(results)), len(results)
+
+print call_instance_concurrently(MyClass9), MyClass9.init_count
+# (["IOError('connection refused',)"], 8) 1
+print call_instance_concurrently(MyClass9), MyClass9.init_count
+# ([140185936421456], 8) 2
+print MyClass9.instance() is MyClass9.instance(), MyClass9.init_count
+# True 2
+print '----------------------------------------------------------------------------------------------------'
+"""
+[方法10][分片加锁的共享状态(Borg)]
+方法2(Bravo)中所有实例的 __dict__ 指向同一个字典，所有写操作都集中在这一个字典上，
+而且 a.x += 1 这样的"读-改-写"操作不是原子的，并发时会丢失更新。
+按属性名把共享状态分散到多个分片(shard)中，每个分片有自己的锁(锁分段, lock striping):
+    读属性不加锁；写属性只锁住该属性所在的分片，不同分片上的写操作互不阻塞；
+    update_many(**kwargs) 按分片序号依次加锁后更新多个属性，对其他写操作是原子的；
+        但读属性不加锁，并发的读者可能看到只完成了一部分分片的更新；
+    update(name, fn) 在分片锁内完成一次"读-改-写"，是原子的；
+在 CPython(GIL) 下分片并不能提高写的吞吐量，见下方的并发测试。
+    compare_and_set(name, expected, value) 当前值等于 expected 时才写入 value，返回是否写入成功；
+        当前值与读属性时一致: 共享状态中没有时取类属性，类属性也没有时视为 None。
+"""
+
+_missing = object()
+
+class Bravo_sharded(object):
+    _n_shards = 16
+    _shards = [({}, threading.Lock()) for _ in xrange(_n_shards)]  # 与 Bravo 一样，所有子类共享同一份状态
+
+    def __getattribute__(self, name):
+        value = Bravo_sharded._shards[hash(name) % Bravo_sharded._n_shards][0].get(name, _missing)
+        if value is _missing:
+            return object.__getattribute__(self, name)
+        return value
+    def __setattr__(self, name, value):
+        shard, lock = Bravo_sharded._shards[hash(name) % Bravo_sharded._n_shards]
+        with lock:
+            shard[name] = value
+    def __delattr__(self, name):
+        shard, lock = Bravo_sharded._shards[hash(name) % Bravo_sharded._n_shards]
+        with lock:
+            if shard.pop(name, _missing) is _missing:
+                raise AttributeError(name)
+    def compare_and_set(self, name, expected, value):
+        shard, lock = Bravo_sharded._shards[hash(name) % Bravo_sharded._n_shards]
+        with lock:
+            current = shard.get(name, _missing)
+            if current is _missing:
+                current = getattr(self.__class__, name, None)
+            if current != expected:
+                return False
+            shard[name] = value
+            return True
+    def update(self, name, fn):
+        """
+        在分片锁内执行 value = fn(当前值) 并写回，返回新值，例如 a.update('counter', lambda v: v + 1)
+        """
+        shard, lock = Bravo_sharded._shards[hash(name) % Bravo_sharded._n_shards]
+        with lock:
+            current = shard.get(name, _missing)
+            if current is _missing:
+                current = getattr(self.__class__, name, None)
+            value = shard[name] = fn(current)
+            return value
+    def update_many(self, **kwargs):
+        by_shard = {}
+        for name, value in kwargs.iteritems():
+            by_shard.setdefault(hash(name) % Bravo_sharded._n_shards, []).append((name, value))
+        indexes = sorted(by_shard)  # 固定加锁顺序，避免死锁
+        locks = [Bravo_sharded._shards[i][1] for i in indexes]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for i in indexes:
+                Bravo_sharded._shards[i][0].update(by_shard[i])
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+class MyClass10(Bravo_sharded):
+    x = 1
+
+a = MyClass10()
+b = MyClass10()
+print a.x
+# 1
+a.x = 9
+a.update_many(y=2, z=3)
+print b.x, b.y, b.z, id(a) == id(b)
+# 9 2 3 False
+print b.compare_and_set('x', 9, 10), a.compare_and_set('x', 9, 11), a.x
+# True False 10
+
+class MyClass10_default(Bravo_sharded):
+    y0 = 5
+
+c = MyClass10_default()
+print c.y0, c.compare_and_set('y0', 5, 6), c.y0
+# 5 True 6
+
+"""
+并发测试:
+N 个线程各执行 M 次"读-改-写"加一，统计每秒操作数，以及最终计数与期望值是否一致。
+    one-key:   所有线程写同一个计数器属性(所有写操作落在同一个分片上)；
+    multi-key: 每个线程写自己的计数器属性 counter_<i>(写操作分散到不同的分片上)。
+    Bravo:                 a.counter += 1
+    Bravo + 全局锁:        持有一把全局锁执行 a.counter += 1
+    Bravo_sharded (cas):   compare_and_set 重试循环
+    Bravo_sharded (update): update(name, fn)，与全局锁一样每次加一只加一次锁，只是锁按属性名分片
+"""
+
+_bravo_lock = threading.Lock()
+
+def incr_plain(obj, name):
+    setattr(obj, name, getattr(obj, name) + 1)
+
+def incr_locked(obj, name):
+    with _bravo_lock:
+        setattr(obj, name, getattr(obj, name) + 1)
+
+def incr_cas(obj, name):
+    while True:
+        current = getattr(obj, name)
+        if obj.compare_and_set(name, current, current + 1):
+            return
+
+def incr_update(obj, name):
+    obj.update(name, _plus_one)
+
+def _plus_one(value):
+    return value + 1
+
+def bench_shared_state(obj, incr, label, multi_key, n_threads=8, n_ops=20000):
+    names = ['counter_%d' % i if multi_key else 'counter' for i in xrange(n_threads)]
+    for name in names:
+        setattr(obj, name, 0)
+    def worker(name):
+        for _ in xrange(n_ops):
+            incr(obj, name)
+    threads = [threading.Thread(target=worker, args=(name,)) for name in names]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    total = sum(getattr(obj, name) for name in set(names))
+    print '%-9s %-15s threads=%d ops/sec=%9.0f counter=%d expected=%d' % (
+        'multi-key' if multi_key else 'one-key', label, n_threads, n_threads * n_ops / elapsed, total, n_threads * n_ops)
+
+for multi_key in (False, True):
+    bench_shared_state(MyClass2(), incr_plain, 'Bravo', multi_key)
+    bench_shared_state(MyClass2(), incr_locked, 'Bravo+lock', multi_key)
+    bench_shared_state(MyClass10(), incr_cas, 'sharded cas', multi_key)
+    bench_shared_state(MyClass10(), incr_update, 'sharded update', multi_key)
+# one-key   Bravo           threads=8 ops/sec=  2983239 counter=81415 expected=160000
+# one-key   Bravo+lock      threads=8 ops/sec=  1154901 counter=160000 expected=160000
+# one-key   sharded cas     threads=8 ops/sec=   329604 counter=160000 expected=160000
+# one-key   sharded update  threads=8 ops/sec=   481109 counter=160000 expected=160000
+# multi-key Bravo           threads=8 ops/sec=  3097413 counter=160000 expected=160000
+# multi-key Bravo+lock      threads=8 ops/sec=  1106448 counter=160000 expected=160000
+# multi-key sharded cas     threads=8 ops/sec=   352218 counter=160000 expected=160000
+# multi-key sharded update  threads=8 ops/sec=   473373 counter=160000 expected=160000
+# update 与全局锁同样每次只加一次锁，差别只在于锁是否分片: 即使在 multi-key 下，分片版本的吞吐量也只有全局锁的一半左右；
+# 在 CPython(GIL) 下同一时刻只有一个线程执行字节码，分片只能减少锁的争用，不能让写操作并行，
+# 而分片版本每次操作多了 __getattribute__、计算分片和方法调用的开销，这部分开销大于减少的争用。
+# 因此在 CPython 中，写多的共享状态用 Bravo + 一把全局锁更快；分片版本的价值只在于接口本身保证不丢失更新
+# (one-key 时 Bravo 的计数结果小于期望值)，调用者不需要自己管理锁。
+print '----------------------------------------------------------------------------------------------------'
+"""
+[方法11][延迟创建的模块级单例]
+方法5在模块导入时就创建了实例，实例创建成本较高时，会直接增加进程的启动时间。
+模块中改为绑定一个轻量的代理对象，导入时不创建实例，第一次访问属性时才创建真正的对象，之后的访问直接转发。
+"""
+"""
+# 在其他模块文件（mysingleton.py）中定义:
+
+class My_Singleton(object):
+    def foo(self):
+        print id(self)
+
+my_singleton = Lazy_singleton(My_Singleton)
+"""
+
+class Lazy_singleton(object):
+    def __init__(self, factory, *args, **kwargs):
+        object.__setattr__(self, '_factory', (factory, args, kwargs))
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+    def _get_instance(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    factory, args, kwargs = self._factory
+                    object.__setattr__(self, '_instance', factory(*args, **kwargs))
+                instance = self._instance
+        return instance
+    def __getattr__(self, attr):
+        return getattr(self._get_instance(), attr)
+    def __setattr__(self, attr, value):
+        setattr(self._get_instance(), attr, value)
+
+class My_Singleton_heavy(object):
+    def __init__(self):
+        time.sleep(0.1)  # 模拟耗时的初始化
+    def foo(self):
+        return id(self)
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return result, time.time() - start
+
+eager, t_eager = timed(lambda: My_Singleton_heavy())
+lazy, t_lazy = timed(lambda: Lazy_singleton(My_Singleton_heavy))
+print 'import   eager=%.6fs lazy=%.6fs' % (t_eager, t_lazy)
+# import   eager=0.100223s lazy=0.000027s
+_, t_first = timed(lambda: lazy.foo())
+_, t_second = timed(lambda: lazy.foo())
+print 'access   first=%.6fs second=%.6fs' % (t_first, t_second)
+# access   first=0.100284s second=0.000017s
+print lazy.foo() == lazy.foo()
+# True
 print '----------------------------------------------------------------------------------------------------'
@@ -27,12 +27,20 @@
 简单工厂模式又称为静态工厂方法(Static Factory Method)模式，它属于类创建型模式。
 """
 
+import collections
+import time
+
 class Product_abstract(object):
     """
     抽象产品
     """
     def use(self):
         pass
+    def reset(self):
+        """
+        放回对象池之前调用，清除使用过程中产生的状态
+        """
+        pass
 
 class Product_concrete_1(Product_abstract):
     """
@@ -70,3 +78,174 @@ operation.use()
 operation = factory.create_product(2)
 operation.use()
 # using: Product_concrete_2
+
+
+"""
+基于注册表的简单工厂
+    Factory.create_product 中的 if/elif 判断链，查找成本随产品类型的个数线性增长，而且每增加一种产品都要修改判断逻辑；
+    用字典保存 类型 -> 构造函数 的映射，查找成本为 O(1)，增加新产品只需要注册，不需要修改工厂类(符合“开闭原则”)；
+    create_products(types) 批量创建产品，把字典查找方法的绑定提到循环之外。
+"""
+
+class Factory_registry(object):
+    """
+    工厂
+    """
+    def __init__(self):
+        self._constructors = {}
+    def register(self, type, constructor):
+        self._constructors[type] = constructor
+    def create_product(self, type):
+        constructor = self._constructors.get(type)
+        if constructor is None:
+            return None
+        return constructor()
+    def create_products(self, types):
+        get = self._constructors.get
+        products = []
+        append = products.append
+        for type in types:
+            constructor = get(type)
+            append(constructor() if constructor is not None else None)
+        return products
+
+
+factory = Factory_registry()
+factory.register(1, Product_concrete_1)
+factory.register(2, Product_concrete_2)
+
+operation = factory.create_product(1)
+operation.use()
+# using: Product_concrete_1
+
+for operation in factory.create_products([2, 1]):
+    operation.use()
+# using: Product_concrete_2
+# using: Product_concrete_1
+
+
+class Factory_chain(object):
+    """
+    工厂: 依次比较每一种类型，与 if/elif 判断链的查找成本相同，用于对比
+    """
+    def __init__(self):
+        self._constructors = []
+    def register(self, type, constructor):
+        self._constructors.append((type, constructor))
+    def create_product(self, type):
+        for key, constructor in self._constructors:
+            if key == type:
+                return constructor()
+        return None
+
+def bench_factory(n_types, n_calls=100000):
+    chain = Factory_chain()
+    registry = Factory_registry()
+    for i in xrange(n_types):
+        product_class = type('Product_concrete_%d' % i, (Product_abstract,), {})
+        chain.register(i, product_class)
+        registry.register(i, product_class)
+    types = [i % n_types for i in xrange(n_calls)]
+    results = []
+    for name, run in (('if/elif', lambda: [chain.create_product(t) for t in types]),
+                      ('registry', lambda: [registry.create_product(t) for t in types]),
+                      ('registry batch', lambda: registry.create_products(types))):
+        start = time.time()
+        run()
+        results.append('%s=%.0f/s' % (name, n_calls / (time.time() - start)))
+    print 'types=%-4d' % n_types, ' '.join(results)
+
+for n_types in (10, 100, 1000):
+    bench_factory(n_types)
+# types=10   if/elif=1036227/s registry=1399776/s registry batch=2486191/s
+# types=100  if/elif=396085/s registry=1805244/s registry batch=2994178/s
+# types=1000 if/elif=52862/s registry=1483811/s registry batch=2423949/s
+
+
+"""
+对象池
+    每次 create_product 都会新建一个产品对象，用完即丢弃，高频创建时会带来大量的内存分配和垃圾回收开销；
+    对象池为每种产品保存一个有界的空闲列表:
+        acquire 优先从空闲列表中取出产品(命中)，空闲列表为空时才新建；
+        release 调用产品的 reset() 后放回空闲列表，空闲列表已满时直接丢弃；
+        stats 报告每种产品空闲列表的占用情况和命中率。
+"""
+
+class Product_pool(object):
+    """
+    对象池
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._free = collections.defaultdict(list)
+        self._pooled = set()  # 空闲列表中产品的 id，防止同一个产品被重复放回
+        self.acquires = 0
+        self.hits = 0
+        self.discards = 0
+    def acquire(self, product_class):
+        self.acquires += 1
+        free = self._free[product_class]
+        if free:
+            self.hits += 1
+            product = free.pop()
+            self._pooled.discard(id(product))
+            return product
+        return product_class()
+    def release(self, product):
+        if id(product) in self._pooled:
+            raise ValueError('%s is already released' % product.__class__.__name__)
+        free = self._free[product.__class__]
+        if len(free) >= self.maxsize:
+            self.discards += 1
+            return
+        product.reset()
+        free.append(product)
+        self._pooled.add(id(product))
+    def stats(self):
+        return {
+            'occupancy': dict((cls.__name__, len(free)) for cls, free in self._free.iteritems()),
+            'hit_rate': float(self.hits) / self.acquires if self.acquires else 0.0,
+            'discards': self.discards,
+        }
+
+class Factory_pooled(Factory_registry):
+    """
+    工厂: 从对象池中获取产品，注册的构造函数必须是产品类
+    """
+    def __init__(self, pool):
+        super(Factory_pooled, self).__init__()
+        self.pool = pool
+    def create_product(self, type):
+        product_class = self._constructors.get(type)
+        if product_class is None:
+            return None
+        return self.pool.acquire(product_class)
+    def create_products(self, types):
+        return [self.create_product(type) for type in types]
+    def release(self, product):
+        self.pool.release(product)
+
+
+factory = Factory_pooled(Product_pool(maxsize=2))
+factory.register(1, Product_concrete_1)
+factory.register(2, Product_concrete_2)
+
+operation = factory.create_product(1)
+operation.use()
+# using: Product_concrete_1
+factory.release(operation)
+print factory.create_product(1) is operation
+# True
+factory.release(operation)
+try:
+    factory.release(operation)
+except ValueError as e:
+    print 'ValueError:', e
+# ValueError: Product_concrete_1 is already released
+
+for i in xrange(1000):
+    operations = factory.create_products([1, 2, 2, 2])
+    for operation in operations:
+        factory.release(operation)
+print factory.pool.stats()
+# {'discards': 1000, 'hit_rate': 0.749375312343828, 'occupancy': {'Product_concrete_2': 2, 'Product_concrete_1': 1}}
@@ -38,12 +38,26 @@
 工厂方法模式又称为工厂模式，也叫虚拟构造器(Virtual Constructor)模式或者多态工厂(Polymorphic Factory)模式，它属于类创建型模式。
 """
 
+import importlib
+import inspect
+import multiprocessing
+import multiprocessing.pool
+import subprocess
+import sys
+import threading
+import time
+
 class Product_abstract(object):
     """
     抽象产品
     """
     def use(self):
         pass
+    def reset(self):
+        """
+        放回对象池之前调用，清除使用过程中产生的状态
+        """
+        pass
 
 class Product_concrete_1(Product_abstract):
     """
@@ -90,3 +104,219 @@ factory_str = Factory_concrete_2()
 product_str = factory_str.create_product()
 product_str.use()
 # using: Product_concrete_2
+
+
+"""
+对象池
+    每次 create_product 都会新建一个产品对象，用完即丢弃，高频创建时会带来大量的内存分配和垃圾回收开销；
+    每个具体工厂只生产一种产品，池化工厂包装一个具体工厂，并为其产品保存一个有界的空闲列表:
+        create_product 优先从空闲列表中取出产品(命中)，空闲列表为空时才调用被包装的工厂新建；
+        release 调用产品的 reset() 后放回空闲列表，空闲列表已满时直接丢弃；
+        stats 报告空闲列表的占用情况和命中率。
+"""
+
+class Factory_pooled(Factory_abstract):
+    """
+    池化工厂
+    """
+    def __init__(self, factory, maxsize=16):
+        self.factory = factory
+        self.maxsize = maxsize
+        self._free = []
+        self._pooled = set()  # 空闲列表中产品的 id，防止同一个产品被重复放回
+        self.acquires = 0
+        self.hits = 0
+        self.discards = 0
+    def create_product(self):
+        self.acquires += 1
+        if self._free:
+            self.hits += 1
+            product = self._free.pop()
+            self._pooled.discard(id(product))
+            return product
+        return self.factory.create_product()
+    def release(self, product):
+        if id(product) in self._pooled:
+            raise ValueError('%s is already released' % product.__class__.__name__)
+        if len(self._free) >= self.maxsize:
+            self.discards += 1
+            return
+        product.reset()
+        self._free.append(product)
+        self._pooled.add(id(product))
+    def stats(self):
+        return {
+            'occupancy': len(self._free),
+            'hit_rate': float(self.hits) / self.acquires if self.acquires else 0.0,
+            'discards': self.discards,
+        }
+
+
+factory_pooled = Factory_pooled(Factory_concrete_1(), maxsize=2)
+product = factory_pooled.create_product()
+product.use()
+# using: Product_concrete_1
+factory_pooled.release(product)
+print factory_pooled.create_product() is product
+# True
+factory_pooled.release(product)
+try:
+    factory_pooled.release(product)
+except ValueError as e:
+    print 'ValueError:', e
+# ValueError: Product_concrete_1 is already released
+
+for i in xrange(1000):
+    products = [factory_pooled.create_product() for _ in xrange(3)]
+    for product in products:
+        factory_pooled.release(product)
+print factory_pooled.stats()
+# {'discards': 1000, 'hit_rate': 0.6662225183211192, 'occupancy': 2}
+
+
+"""
+异步工厂
+    具体工厂在调用者的线程中同步创建产品，产品的创建需要大量计算时，调用者会被阻塞，也无法利用多核；
+    异步工厂包装一个具体工厂，把 create_product 提交到进程池(或线程池)中执行，立即返回一个 AsyncResult(future)，通过 get() 获取产品；
+    create_many(n) 把 n 个产品的创建分块分散到进程池的各个进程中，返回一个 AsyncResult，get() 得到产品列表。
+使用进程池时，具体工厂需要被 pickle 传给子进程，创建好的产品需要被 pickle 传回，
+因此工厂类和产品类都必须定义在模块顶层，含有不可 pickle 的属性(锁、socket 等)的产品需要实现 __getstate__/__setstate__。
+"""
+
+def _create_product(factory):
+    return factory.create_product()
+
+class Factory_async(Factory_abstract):
+    """
+    异步工厂
+    """
+    def __init__(self, factory, pool):
+        self.factory = factory
+        self.pool = pool
+    def create_product(self):
+        return self.pool.apply_async(_create_product, (self.factory,))
+    def create_many(self, n, chunksize=None):
+        if chunksize is None:
+            chunksize = max(1, n // (4 * multiprocessing.cpu_count()))  # 分块，减少任务分发和 pickle 的次数
+        return self.pool.map_async(_create_product, [self.factory] * n, chunksize)
+
+class Product_concrete_heavy(Product_abstract):
+    """
+    具体产品: 创建时需要大量计算，并持有一个不可 pickle 的锁
+    """
+    def __init__(self):
+        self.table = sum(i * i for i in xrange(200000))
+        self.lock = threading.Lock()
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+    def use(self):
+        print 'using:', self.__class__.__name__
+
+class Factory_concrete_heavy(Factory_abstract):
+    """
+    具体工厂
+    """
+    def create_product(self):
+        return Product_concrete_heavy()
+
+
+process_pool = multiprocessing.Pool()
+factory_async = Factory_async(Factory_concrete_heavy(), process_pool)
+future = factory_async.create_product()
+future.get(timeout=10).use()
+# using: Product_concrete_heavy
+
+thread_pool = multiprocessing.pool.ThreadPool(4)
+factory_async = Factory_async(Factory_concrete_1(), thread_pool)
+future = factory_async.create_product()
+future.get(timeout=10).use()
+# using: Product_concrete_1
+thread_pool.close()
+thread_pool.join()
+
+n = 32
+start = time.time()
+products = [Factory_concrete_heavy().create_product() for _ in xrange(n)]
+t_sync = time.time() - start
+start = time.time()
+products = Factory_async(Factory_concrete_heavy(), process_pool).create_many(n).get(timeout=60)
+t_async = time.time() - start
+print 'cpus=%d n=%d sync=%.3fs process_pool=%.3fs' % (multiprocessing.cpu_count(), len(products), t_sync, t_async)
+# cpus=1 n=32 sync=0.402s process_pool=0.367s
+process_pool.close()
+process_pool.join()
+
+
+"""
+延迟加载的工厂注册表
+    具体工厂通常和抽象工厂定义在同一个模块中，并且在启动时全部导入，具体工厂很多时，导入会拖慢启动；
+    注册表只保存一份声明式的清单(key -> 'module:Class')，第一次请求某个 key 时才导入对应的模块并创建具体工厂，之后直接使用缓存；
+    load_all() 一次性导入清单中的全部具体工厂(即原来的立即加载方式)。
+"""
+
+class Factory_registry(object):
+    """
+    工厂注册表
+    """
+    def __init__(self, manifest):
+        self._manifest = dict(manifest)
+        self._factories = {}
+    def _load(self, key):
+        module_name, _, class_name = self._manifest[key].partition(':')
+        factory_class = getattr(importlib.import_module(module_name), class_name)
+        factory = self._factories[key] = factory_class()
+        return factory
+    def get_factory(self, key):
+        factory = self._factories.get(key)
+        if factory is None:
+            factory = self._load(key)
+        return factory
+    def create_product(self, key):
+        return self.get_factory(key).create_product()
+    def load_all(self):
+        for key in self._manifest:
+            if key not in self._factories:
+                self._load(key)
+
+
+factory_registry = Factory_registry({
+    'product_1': '__main__:Factory_concrete_1',
+    'product_2': '__main__:Factory_concrete_2',
+})
+factory_registry.create_product('product_2').use()
+# using: Product_concrete_2
+
+# 用标准库中的模块模拟大量的具体工厂，对比两种方式的注册耗时
+# 每种方式都在一个新的解释器进程中计时，避免模块已经被前一次计时导入
+manifest = {
+    'decimal': 'decimal:Decimal',
+    'fractions': 'fractions:Fraction',
+    'json': 'json:JSONDecoder',
+    'minidom': 'xml.dom.minidom:Document',
+    'mime': 'email.mime.multipart:MIMEMultipart',
+    'argparse': 'argparse:ArgumentParser',
+    'difflib': 'difflib:SequenceMatcher',
+}
+
+def time_registration(statement):
+    code = '\n'.join([
+        'import importlib, time',
+        inspect.getsource(Factory_registry),
+        'manifest = %r' % (manifest,),
+        'start = time.time()',
+        'registry = Factory_registry(manifest)',
+        statement,
+        'print time.time() - start',
+    ])
+    return float(subprocess.check_output([sys.executable, '-c', code]))
+
+t_lazy = time_registration('pass')
+t_first = time_registration("registry.get_factory('json')")
+t_eager = time_registration('registry.load_all()')
+print 'register lazy=%.6fs (with first request=%.6fs) eager=%.6fs' % (t_lazy, t_first, t_eager)
+# register lazy=0.000004s (with first request=0.001980s) eager=0.036401s
@@ -39,6 +39,13 @@
 建造者模式属于对象创建型模式。根据中文翻译的不同，建造者模式又可以称为生成器模式。
 """
 
+import Queue
+import collections
+import copy
+import multiprocessing.pool
+import sys
+import time
+
 class Product(object):
     """
     产品
@@ -53,8 +60,12 @@ class Builder_abstract(object):
     """
     抽象建造者
     """
+    part_dependencies = {'build_partA': (), 'build_partB': ()}  # 部件构造方法 -> 它依赖的部件构造方法
+    part_inputs = {'build_partA': (), 'build_partB': ()}  # 部件构造方法 -> 它读取的输入(self.inputs 中的 key)
+    reuse_product = False  # 为 True 表示 new_product() 只是新建一个空白的 Product，批量建造时可以复用同一个产品对象
     def __init__(self):
         self.product = None
+        self.inputs = {}
     def new_product(self):
         self.product = Product()
     def build_partA(self):
@@ -107,3 +118,314 @@ director_2.build_parts()
 product_2 = director_2.get_product()
 print product_2
 # [product:Product]=[part_a:small Part_A]+[part_b:small Part_B]
+
+
+"""
+批量建造: 按列存储(struct of arrays)
+    Director.build_parts 每次建造一个 Product，每个产品都有自己的 __dict__ 保存 part_a 和 part_b，
+    批量建造大量产品时，每个产品对象及其 __dict__ 的内存开销远大于部件本身；
+    批量指挥者每次建造后把各个部件依次追加到对应的列中(每个部件一个列表)，产品对象用完即丢弃，
+    建造者声明了 reuse_product 时，复用同一个临时产品对象，不再每次调用 new_product()，
+    下游代码可以直接按列批量处理部件，也可以通过行视图像访问 Product 一样访问某一个产品。
+"""
+
+class Product_columns(object):
+    """
+    按列存储的产品集合
+    """
+    parts = ('part_a', 'part_b')
+    def __init__(self):
+        self.columns = dict((part, []) for part in self.parts)
+    def __len__(self):
+        return len(self.columns[self.parts[0]])
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        return Product_row(self, index % len(self))
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield Product_row(self, index)
+
+class Product_row(object):
+    """
+    行视图: 按 Product 的接口访问按列存储的某一个产品
+    """
+    __slots__ = ('_store', '_index')
+    def __init__(self, store, index):
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_index', index)
+    def __getattr__(self, attr):
+        try:
+            return self._store.columns[attr][self._index]
+        except KeyError:
+            raise AttributeError(attr)
+    def __setattr__(self, attr, value):
+        try:
+            self._store.columns[attr][self._index] = value  # 写回到对应的列中
+        except KeyError:
+            raise AttributeError("'%s' is not a part of %s" % (attr, Product.__name__))
+    def __str__(self):
+        return '[product:%s]=[part_a:%s]+[part_b:%s]' % (Product.__name__, self.part_a, self.part_b)
+
+class Director_batch(object):
+    """
+    批量指挥者
+    """
+    def __init__(self, builder):
+        self.builder = builder
+    def build_many(self, n, store=None):
+        if store is None:
+            store = Product_columns()
+        builder = self.builder
+        if builder.reuse_product:
+            builder.new_product()
+            new_product = builder.product.__init__  # 复用同一个临时产品对象
+        else:
+            new_product = builder.new_product  # new_product() 可能设置了部件的默认值
+        appends = [(part, store.columns[part].append) for part in store.parts]
+        for _ in xrange(n):
+            new_product()
+            builder.build_partA()
+            builder.build_partB()
+            product = builder.product
+            for part, append in appends:
+                append(getattr(product, part))
+        return store
+
+
+director_batch = Director_batch(Builder_concrete_1())
+products = director_batch.build_many(2)
+director_batch.builder = Builder_concrete_2()
+director_batch.build_many(1, products)
+for product in products:
+    print product
+# [product:Product]=[part_a:big Part_A]+[part_b:big Part_B]
+# [product:Product]=[part_a:big Part_A]+[part_b:big Part_B]
+# [product:Product]=[part_a:small Part_A]+[part_b:small Part_B]
+print products[-1].part_a, products.columns['part_b']
+# small Part_A ['big Part_B', 'big Part_B', 'small Part_B']
+products[0].part_b = 'huge Part_B'
+print products[0], products.columns['part_b']
+# [product:Product]=[part_a:big Part_A]+[part_b:huge Part_B] ['huge Part_B', 'big Part_B', 'small Part_B']
+
+class Builder_default_B(Builder_abstract):
+    """
+    具体建造者: new_product 设置部件的默认值
+    """
+    def new_product(self):
+        self.product = Product()
+        self.product.part_b = 'default B'
+    def build_partA(self):
+        self.product.part_a = 'big Part_A'
+
+
+print Director_batch(Builder_default_B()).build_many(1)[0]
+# [product:Product]=[part_a:big Part_A]+[part_b:default B]
+
+n = 100000
+objects = []
+for _ in xrange(n):
+    director_1.build_parts()
+    objects.append(director_1.get_product())
+builder_reuse = Builder_concrete_1()
+builder_reuse.reuse_product = True
+columns = Director_batch(builder_reuse).build_many(n)
+size_objects = sys.getsizeof(objects) + sum(sys.getsizeof(p) + sys.getsizeof(p.__dict__) for p in objects)
+size_columns = sum(sys.getsizeof(column) for column in columns.columns.values())
+print 'n=%d objects=%d bytes columns=%d bytes' % (n, size_objects, size_columns)
+# n=100000 objects=35224472 bytes columns=1648944 bytes
+
+
+"""
+按依赖关系并行建造部件
+    Director.build_parts 严格按顺序依次建造各个部件，部件之间相互独立且耗时主要在 I/O 上时，总耗时是各部件耗时之和；
+    建造者通过 part_dependencies 声明部件之间的依赖关系，并行指挥者把所有依赖都已完成的部件提交到线程池中同时建造，
+    某个部件完成后，再提交因此而满足依赖的部件，总耗时接近依赖关系中最长路径(关键路径)的耗时；
+    timings 记录每个部件的建造耗时以及总耗时。
+"""
+
+class Director_parallel(Director):
+    """
+    并行指挥者
+    """
+    def __init__(self, builder, pool):
+        super(Director_parallel, self).__init__(builder)
+        self.pool = pool
+        self.timings = {}
+    def _build_part(self, name, done):
+        start = time.time()
+        try:
+            getattr(self.builder, name)()
+        except Exception:
+            done.put((name, time.time() - start, sys.exc_info()))
+        else:
+            done.put((name, time.time() - start, None))
+    def build_parts(self):
+        self.builder.new_product()
+        waiting = {}
+        dependents = {}
+        for name, dependencies in self.builder.part_dependencies.iteritems():
+            waiting[name] = set(dependencies)
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(name)
+        done = Queue.Queue()
+        timings = {}
+        running = 0
+        start = time.time()
+        while waiting or running:
+            for name in [name for name, dependencies in waiting.iteritems() if not dependencies]:
+                del waiting[name]
+                self.pool.apply_async(self._build_part, (name, done))
+                running += 1
+            if not running:
+                raise ValueError('unsatisfiable part dependencies: %s' % sorted(waiting))
+            name, elapsed, error = done.get()
+            running -= 1
+            if error is not None:
+                raise error[0], error[1], error[2]
+            timings[name] = elapsed
+            for dependent in dependents.get(name, ()):
+                waiting[dependent].discard(name)
+        timings['total'] = time.time() - start
+        self.timings = timings
+
+class Builder_concrete_io(Builder_abstract):
+    """
+    具体建造者: 部件相互独立，建造时需要等待 I/O
+    """
+    def build_partA(self):
+        time.sleep(0.1)
+        self.product.part_a = 'remote Part_A'
+    def build_partB(self):
+        time.sleep(0.1)
+        self.product.part_b = 'remote Part_B'
+
+class Builder_concrete_io_dependent(Builder_concrete_io):
+    """
+    具体建造者: 部件 B 依赖部件 A
+    """
+    part_dependencies = {'build_partA': (), 'build_partB': ('build_partA',)}
+    def build_partB(self):
+        time.sleep(0.1)
+        self.product.part_b = 'remote Part_B after %s' % self.product.part_a
+
+
+def format_timings(timings):
+    return ' '.join('%s=%.2fs' % (name, timings[name]) for name in sorted(timings))
+
+thread_pool = multiprocessing.pool.ThreadPool(4)
+for builder in (Builder_concrete_io(), Builder_concrete_io_dependent()):
+    director = Director_parallel(builder, thread_pool)
+    director.build_parts()
+    print director.get_product()
+    print format_timings(director.timings)
+# [product:Product]=[part_a:remote Part_A]+[part_b:remote Part_B]
+# build_partA=0.10s build_partB=0.10s total=0.10s
+# [product:Product]=[part_a:remote Part_A]+[part_b:remote Part_B after remote Part_A]
+# build_partA=0.10s build_partB=0.10s total=0.20s
+thread_pool.close()
+thread_pool.join()
+
+
+"""
+增量建造: 按部件缓存
+    Director.build_parts 每次都调用 new_product() 并重新建造全部部件，即使只有一个输入发生了变化；
+    建造者通过 part_inputs 声明每个部件依赖哪些输入，增量指挥者以这些输入的值为 key 缓存每个部件的建造结果(部件对产品属性的修改)，
+    重新建造时，只有输入发生变化的部件才会重新执行，其余部件直接使用缓存的结果装配新的 Product；
+    缓存中保存的是部件的副本，命中时可变的部件(列表、字典等)再复制一份交给新产品，修改某个产品的部件不会影响缓存和其他产品；
+    每个部件的缓存最多保存 maxsize 组输入的结果，超出时按 LRU 淘汰；
+    输入中有不可哈希的值(列表、字典等)时无法作为 key，该部件直接重新建造，记为 uncacheable；
+    hits/misses/uncacheable 按部件统计缓存的命中、未命中与无法缓存的次数。
+"""
+
+_immutable_parts = (int, long, float, complex, bool, str, unicode, type(None), frozenset)
+
+def _copy_part(value):
+    if isinstance(value, _immutable_parts):
+        return value
+    return copy.deepcopy(value)
+
+class Director_incremental(Director):
+    """
+    增量指挥者
+    """
+    steps = ('build_partA', 'build_partB')
+    def __init__(self, builder, maxsize=128):
+        super(Director_incremental, self).__init__(builder)
+        self.maxsize = maxsize
+        self._memo = dict((step, collections.OrderedDict()) for step in self.steps)
+        self.hits = dict((step, 0) for step in self.steps)
+        self.misses = dict((step, 0) for step in self.steps)
+        self.uncacheable = dict((step, 0) for step in self.steps)
+    def build_parts(self, **inputs):
+        builder = self.builder
+        builder.inputs = inputs
+        builder.new_product()
+        product = builder.product
+        for step in self.steps:
+            key = tuple(inputs.get(name) for name in builder.part_inputs[step])
+            memo = self._memo[step]
+            try:
+                changes = memo.pop(key, None)
+            except TypeError:
+                self.uncacheable[step] += 1
+                getattr(builder, step)()
+                continue
+            if changes is None:
+                self.misses[step] += 1
+                before = dict(product.__dict__)
+                getattr(builder, step)()
+                changes = dict((attr, _copy_part(value)) for attr, value in product.__dict__.iteritems()
+                               if attr not in before or before[attr] is not value)
+                if len(memo) >= self.maxsize:
+                    memo.popitem(last=False)
+            else:
+                self.hits[step] += 1
+                for attr, value in changes.iteritems():
+                    setattr(product, attr, _copy_part(value))
+            memo[key] = changes  # 重新插入到末尾，即最近使用
+
+class Builder_config(Builder_abstract):
+    """
+    具体建造者: 由配置输入装配产品，部件 A 只依赖 env，部件 B 依赖 env 和 region
+    """
+    part_inputs = {'build_partA': ('env',), 'build_partB': ('env', 'region')}
+    def build_partA(self):
+        self.product.part_a = '%s Part_A' % self.inputs['env']
+    def build_partB(self):
+        self.product.part_b = '%s/%s Part_B' % (self.inputs['env'], self.inputs['region'])
+
+
+director = Director_incremental(Builder_config())
+director.build_parts(env='prod', region='us')
+print director.get_product()
+# [product:Product]=[part_a:prod Part_A]+[part_b:prod/us Part_B]
+director.build_parts(env='prod', region='eu')
+print director.get_product()
+# [product:Product]=[part_a:prod Part_A]+[part_b:prod/eu Part_B]
+director.build_parts(env='prod', region='us')
+print director.get_product()
+# [product:Product]=[part_a:prod Part_A]+[part_b:prod/us Part_B]
+print director.hits, director.misses
+# {'build_partB': 1, 'build_partA': 2} {'build_partB': 2, 'build_partA': 1}
+
+class Builder_config_list(Builder_config):
+    """
+    具体建造者: 部件 A 是可变的列表，region 可以是列表
+    """
+    def build_partA(self):
+        self.product.part_a = [self.inputs['env']]
+    def build_partB(self):
+        self.product.part_b = '%s/%s Part_B' % (self.inputs['env'], self.inputs['region'])
+
+director = Director_incremental(Builder_config_list(), maxsize=1)
+director.build_parts(env='prod', region=['us', 'eu'])  # region 是列表，部件 B 无法缓存
+product_1 = director.get_product()
+director.build_parts(env='prod', region=['us', 'eu'])
+product_2 = director.get_product()
+product_2.part_a.append('mutated')  # 不影响缓存和其他产品
+director.build_parts(env='prod', region='us')
+print product_1.part_a, product_2.part_a, director.get_product().part_a
+# ['prod'] ['prod', 'mutated'] ['prod']
+print director.hits, director.misses, director.uncacheable
+# {'build_partB': 0, 'build_partA': 2} {'build_partB': 1, 'build_partA': 1} {'build_partB': 2, 'build_partA': 0}
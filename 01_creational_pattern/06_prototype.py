@@ -34,6 +34,8 @@
 """
 
 import copy
+import sys
+import time
 
 class Prototype_abstract(object):
     """
@@ -66,3 +68,386 @@ print id(prototype_c), prototype_c.__dict__
 # 4559790992 {'a': 'A'}
 # 4559791056 {'a': 'A', 'b': 'B'}
 # 4559791120 {'a': 'A', 'c': 'C', 'b': 'B'}
+
+
+"""
+写时复制(Copy-on-Write)克隆
+    Prototype_concrete.clone 每次都执行 copy.deepcopy(self)，即使克隆对象只修改了一个属性，克隆的成本也随原型的大小增长；
+    写时复制克隆只复制一层属性字典，容器等可变的属性值由原型和克隆对象共享，记录在各自的 _cow 中，
+    某一方第一次访问共享的属性时，才深拷贝这一个属性，未访问的属性一直保持共享。
+    不可变的属性值(数字、字符串等)直接共享，不需要复制。
+    每个对象的各次复制共用一个 memo，互相引用(别名)的属性复制后仍然互相引用，与 copy.deepcopy 整个对象的结果一致。
+Python 无法区分访问属性后是读还是写，因此只读访问也会复制这个属性，实际上是"首次访问时复制"；
+只在克隆后只访问少数几个可变属性时才能节省复制的成本。
+"""
+
+_immutable_types = (int, long, float, complex, bool, str, unicode, type(None), frozenset)
+
+class Prototype_cow(Prototype_abstract):
+    """
+    具体原型类: 写时复制
+    """
+    def __init__(self):
+        self._cow = {}
+        self._memo = {}
+    def __getattr__(self, name):
+        d = self.__dict__
+        try:
+            value = d['_cow'].pop(name)
+        except KeyError:
+            raise AttributeError(name)
+        value = d[name] = copy.deepcopy(value, d['_memo'])
+        return value
+    def __delattr__(self, name):
+        shared = self.__dict__['_cow']
+        if name in shared:
+            del shared[name]
+            self.__dict__.pop(name, None)
+        else:
+            object.__delattr__(self, name)
+    def clone(self, **kwargs):
+        own = self.__dict__
+        memo = own['_memo']
+        # 尚未复制的属性如果与已复制的属性互相引用，它当前的值是 memo 中的副本
+        shared = dict((name, memo.get(id(value), value)) for name, value in own['_cow'].iteritems())
+        for name, value in own.items():
+            if name not in ('_cow', '_memo') and not isinstance(value, _immutable_types):
+                shared[name] = value  # 可变的属性值改为共享，原型自己再访问时也会先复制
+                del own[name]
+        own['_cow'] = shared
+        own['_memo'] = {}
+        new_object = object.__new__(self.__class__)
+        new_object.__dict__.update(own)
+        new_object._cow = shared.copy()
+        new_object._memo = {}
+        new_object.__dict__.update(**kwargs)
+        return new_object
+
+
+prototype_0 = Prototype_cow()
+prototype_0.items = [1, 2]
+prototype_a = prototype_0.clone(a='A')
+prototype_a.items.append(3)
+print prototype_0.items, prototype_a.items, prototype_a.a
+# [1, 2] [1, 2, 3] A
+prototype_0.alias = prototype_0.items
+prototype_b = prototype_0.clone()
+prototype_b.items.append(4)
+print prototype_0.items is prototype_0.alias, prototype_b.items is prototype_b.alias, prototype_b.alias
+# True True [1, 2, 4]
+
+def make_prototype(prototype_class, n_attrs):
+    prototype = prototype_class()
+    for i in xrange(n_attrs):
+        setattr(prototype, 'attr_%d' % i, [i])
+    return prototype
+
+def clone_size(prototype):
+    size = sys.getsizeof(prototype.__dict__)
+    for name, value in prototype.__dict__.iteritems():
+        if name in ('_cow', '_memo'):
+            size += sys.getsizeof(value)  # 共享的属性值不计入
+        elif not isinstance(value, _immutable_types):
+            size += sys.getsizeof(value)
+    return size
+
+for n_attrs in (10, 1000, 100000):
+    results = []
+    for prototype_class in (Prototype_concrete, Prototype_cow):
+        prototype = make_prototype(prototype_class, n_attrs)
+        prototype.clone()  # 写时复制: 第一次克隆时把原型的可变属性改为共享
+        start = time.time()
+        new_object = prototype.clone(a='A')
+        elapsed = time.time() - start
+        results.append('%s=%.6fs/%dB' % (prototype_class.__name__, elapsed, clone_size(new_object)))
+    print 'attrs=%-6d' % n_attrs, ' '.join(results)
+# attrs=10     Prototype_concrete=0.000043s/2088B Prototype_cow=0.000007s/1608B
+# attrs=1000   Prototype_concrete=0.002774s/153432B Prototype_cow=0.000266s/49992B
+# attrs=100000 Prototype_concrete=0.575045s/16691736B Prototype_cow=0.050770s/6292296B
+
+
+"""
+分层增量(delta)克隆
+    prototype_0 -> a -> b -> c 这样的克隆链中，每个克隆对象都保存父对象属性的完整副本再加上一个新属性，克隆链很长时内存按平方增长；
+    与 ChainMap 类似，分层增量克隆只在自己的 __dict__ 中保存本次克隆修改的属性，其余属性沿着 _parent 逐层向上查找；
+    克隆链的深度超过 max_depth 时，新的克隆对象把整条链的属性合并(展平)到自己的 __dict__ 中，作为新的根，以限制查找的层数。
+每次展平都会复制整条链的属性，因此 n 层克隆链的内存仍然按平方增长，只是约为完整复制时的 1/max_depth；
+max_depth 越大内存越省，但读取深层属性需要逐层查找，越慢。
+与类属性同名的属性(如覆盖了类属性 max_depth)不经过 __getattr__，克隆时直接复制到每一层的 __dict__ 中；
+被克隆过的原型会被冻结(不能再修改或删除属性)，否则它的修改会被所有克隆对象看到；
+属性值在各层之间按引用共享，适合属性值不可变的原型。
+"""
+
+_layer_attrs = frozenset(('_parent', '_depth', '_frozen'))
+
+class Prototype_delta(Prototype_abstract):
+    """
+    具体原型类: 分层增量
+    """
+    max_depth = 8
+    def __init__(self):
+        d = self.__dict__
+        d['_parent'] = None
+        d['_depth'] = 0
+        d['_frozen'] = False
+    def __getattr__(self, name):
+        parent = self.__dict__.get('_parent')
+        while parent is not None:
+            d = parent.__dict__
+            if name in d:
+                return d[name]
+            parent = d['_parent']
+        raise AttributeError(name)
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError("can't set attribute %r of a cloned prototype" % name)
+        object.__setattr__(self, name, value)
+    def __delattr__(self, name):
+        if self._frozen:
+            raise AttributeError("can't delete attribute %r of a cloned prototype" % name)
+        object.__delattr__(self, name)
+    def attrs(self):
+        """
+        合并整条克隆链后的属性
+        """
+        layers = []
+        prototype = self
+        while prototype is not None:
+            layers.append(prototype.__dict__)
+            prototype = prototype.__dict__['_parent']
+        merged = {}
+        for d in reversed(layers):
+            merged.update(d)
+        for name in _layer_attrs:
+            del merged[name]
+        return merged
+    def clone(self, **kwargs):
+        self.__dict__['_frozen'] = True
+        new_object = object.__new__(self.__class__)
+        d = new_object.__dict__
+        if self._depth >= self.max_depth:
+            d.update(self.attrs())
+            d['_parent'] = None
+            d['_depth'] = 0
+        else:
+            d['_parent'] = self
+            d['_depth'] = self._depth + 1
+            cls = self.__class__
+            for name, value in self.__dict__.iteritems():
+                if name not in _layer_attrs and hasattr(cls, name):
+                    d[name] = value  # 与类属性同名的属性，沿 _parent 查找前会先找到类属性
+        d['_frozen'] = False
+        d.update(**kwargs)
+        return new_object
+
+
+prototype_0 = Prototype_delta()
+prototype_a = prototype_0.clone(a='A')
+prototype_b = prototype_a.clone(b='B')
+prototype_c = prototype_b.clone(c='C')
+print prototype_c.a, prototype_c.b, prototype_c.c, prototype_c.attrs()
+# A B C {'c': 'C', 'b': 'B', 'a': 'A'}
+print dict((k, v) for k, v in prototype_c.__dict__.iteritems() if k not in _layer_attrs)
+# {'c': 'C'}
+try:
+    del prototype_a.a
+except AttributeError as e:
+    print 'AttributeError:', e
+# AttributeError: can't delete attribute 'a' of a cloned prototype
+
+class Monster(Prototype_delta):
+    """
+    具体原型类: 带有默认值的类属性
+    """
+    hp = 100
+
+
+monster = Monster()
+monster.hp = 50
+print monster.clone().clone().hp, monster.clone(max_depth=1).clone()._depth  # 深度达到 max_depth 后展平
+# 50 0
+
+def clone_chain(prototype, n):
+    chain = [prototype]
+    for i in xrange(n):
+        chain.append(chain[-1].clone(**{'attr_%d' % i: i}))
+    return chain
+
+def chain_size(chain):
+    return sum(sys.getsizeof(prototype.__dict__) for prototype in chain)
+
+n = 1000
+for name, prototype in (('deepcopy', Prototype_concrete()), ('delta', Prototype_delta())):
+    chain = clone_chain(prototype, n)
+    last = chain[-1]
+    start = time.time()
+    for _ in xrange(10000):
+        last.attr_0
+    print 'chain=%d %-8s memory=%dB root attr read=%.3fus' % (n, name, chain_size(chain), (time.time() - start) * 100)
+# chain=1000 deepcopy memory=32654168B root attr read=0.090us
+# chain=1000 delta    memory=3902936B root attr read=0.952us
+
+
+"""
+原型注册表: 为每个类生成专用的克隆函数
+    copy.deepcopy 是通用的，需要遍历对象的每一个属性，并为每个对象维护 memo 字典；
+    对于频繁克隆的原型，对象的结构(属性名，包括 __slots__ 中声明的属性)在注册时就已经知道，
+    注册表在注册时根据原型的属性布局生成一个展开的克隆函数: 逐个属性直接读取，不可变的属性值直接共享，其他属性值才调用 deepcopy；
+    注册之后新增的、布局中没有的属性，回退到 deepcopy。
+"""
+
+_clone_template = '''
+def clone(src):
+    new = new_object(cls)
+    memo = {}
+%s
+    return new
+'''
+
+_clone_dict_template = '''
+    sd = src.__dict__
+    nd = new.__dict__
+%s
+    if not dict_fields.issuperset(sd):
+        for name, v in sd.iteritems():
+            if name not in dict_fields:
+                nd[name] = deepcopy(v, memo)
+'''
+
+_clone_dict_field = '''
+    v = sd.get(%(name)r, missing)
+    if v is not missing:
+        nd[%(name)r] = v if v.__class__ in immutable else deepcopy(v, memo)'''
+
+_clone_slot_field = '''
+    try:
+        v = slot_%(index)d.__get__(src, cls)  # 只有该 slot 在原型上未赋值时才会抛出 AttributeError
+    except AttributeError:
+        pass
+    else:
+        slot_%(index)d.__set__(new, v if v.__class__ in immutable else deepcopy(v, memo))'''
+
+def _mangle(klass, name):
+    # 类体中以 __ 开头(且不以 __ 结尾)的名字会被改写为 _<类名>__name
+    if name.startswith('__') and not name.endswith('__'):
+        return '_%s%s' % (klass.__name__.lstrip('_'), name)
+    return name
+
+def _slot_descriptors(cls):
+    descriptors = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+        for name in slots:
+            if name in ('__dict__', '__weakref__'):
+                continue
+            descriptors.append(klass.__dict__[_mangle(klass, name)])  # 直接使用 slot 的成员描述符
+    return descriptors
+
+def make_clone_function(prototype):
+    cls = prototype.__class__
+    descriptors = _slot_descriptors(cls)
+    body = [_clone_slot_field % {'index': index} for index in xrange(len(descriptors))]
+    dict_fields = frozenset()
+    if hasattr(prototype, '__dict__'):
+        dict_fields = frozenset(prototype.__dict__)
+        body.append(_clone_dict_template % ''.join(_clone_dict_field % {'name': name} for name in sorted(dict_fields)))
+    namespace = {
+        'cls': cls,
+        'new_object': object.__new__,
+        'deepcopy': copy.deepcopy,
+        'immutable': frozenset(_immutable_types),
+        'missing': object(),
+        'dict_fields': dict_fields,
+    }
+    for index, descriptor in enumerate(descriptors):
+        namespace['slot_%d' % index] = descriptor
+    exec _clone_template % ''.join(body) in namespace
+    return namespace['clone']
+
+class Prototype_registry(object):
+    """
+    原型注册表
+    """
+    def __init__(self):
+        self._prototypes = {}
+        self._clone_functions = {}
+    def register(self, key, prototype):
+        cls = prototype.__class__
+        if cls not in self._clone_functions:
+            self._clone_functions[cls] = make_clone_function(prototype)
+        self._prototypes[key] = prototype
+    def unregister(self, key):
+        del self._prototypes[key]
+    def clone(self, key, **kwargs):
+        prototype = self._prototypes[key]
+        new_object = self._clone_functions[prototype.__class__](prototype)
+        for attr, value in kwargs.iteritems():
+            setattr(new_object, attr, value)
+        return new_object
+
+class Prototype_slots(Prototype_abstract):
+    """
+    具体原型类: 使用 __slots__
+    """
+    __slots__ = ('name', 'level', 'tags')
+    def clone(self, **kwargs):
+        new_object = copy.deepcopy(self)
+        for attr, value in kwargs.iteritems():
+            setattr(new_object, attr, value)
+        return new_object
+
+
+prototype_dict = Prototype_concrete()
+prototype_dict.__dict__.update(('field_%d' % i, i) for i in xrange(8))
+prototype_dict.name = 'orc'
+prototype_dict.tags = ['green', 'big']
+prototype_slots = Prototype_slots()
+prototype_slots.name = 'elf'
+prototype_slots.level = 1
+prototype_slots.tags = ['tall']
+
+registry = Prototype_registry()
+registry.register('orc', prototype_dict)
+registry.register('elf', prototype_slots)
+
+orc = registry.clone('orc', name='orc chief')
+orc.tags.append('angry')
+print orc.name, orc.tags, prototype_dict.tags
+# orc chief ['green', 'big', 'angry'] ['green', 'big']
+prototype_dict.extra = {'unknown': 'field'}  # 注册后新增的属性，回退到 deepcopy
+print registry.clone('orc').extra is not prototype_dict.extra
+# True
+elf = registry.clone('elf', level=2)
+print elf.name, elf.level, elf.tags is not prototype_slots.tags
+# elf 2 True
+
+class Prototype_secret(Prototype_slots):
+    """
+    具体原型类: 名字被改写的 slot
+    """
+    __slots__ = ('__secret',)
+    def __init__(self, secret):
+        self.__secret = secret
+    def secret(self):
+        return self.__secret
+
+registry.register('secret', Prototype_secret('42'))
+print registry.clone('secret').secret()
+# 42
+
+n = 20000
+for key, prototype in (('orc', prototype_dict), ('elf', prototype_slots)):
+    start = time.time()
+    for _ in xrange(n):
+        prototype.clone()
+    t_deepcopy = time.time() - start
+    start = time.time()
+    for _ in xrange(n):
+        registry.clone(key)
+    t_generated = time.time() - start
+    print '%s %-16s clones/sec deepcopy=%.0f generated=%.0f' % (
+        key, prototype.__class__.__name__, n / t_deepcopy, n / t_generated)
+# orc Prototype_concrete clones/sec deepcopy=18461 generated=61343
+# elf Prototype_slots  clones/sec deepcopy=27327 generated=145621
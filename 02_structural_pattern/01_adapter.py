@@ -29,6 +29,11 @@
     想要建立一个可以重复使用的类，用于与一些彼此之间没有太大关联的一些类一起工作。
 """
 
+import itertools
+import multiprocessing.pool
+import threading
+import time
+
 class Cat(object):
     """
     适配者类
@@ -98,3 +103,387 @@ for animal in animals:
 # Cat meow ~
 # Dog woof !
 # Human hello ?
+
+
+"""
+缓存类型分派表和转发属性的适配器
+    Adapter.make_noise 每次调用都要依次执行 isinstance 判断，适配者类型越多越慢，增加新的适配者类型还要修改判断逻辑；
+    Adapter.__getattr__ 每次访问都要经过 __getattr__ 转发给适配者。
+    分派表保存 适配者类型 -> 适配者方法，每种类型只解析一次(未注册的子类按 MRO 找到已注册的父类后缓存)，新的适配者类型通过 register 注册；
+    转发过的方法(定义在适配者类上的可调用属性)缓存在适配器实例的 __dict__ 中，再次访问时不再经过 __getattr__；
+    适配者实例上的数据属性可能随时改变，不缓存，每次都转发，始终读到最新的值；invalidate 清除缓存的方法。
+"""
+
+class Adapter_cached(Target):
+    """
+    适配器类
+    """
+    _dispatch = {}
+    _registered = {}
+    @classmethod
+    def _own(cls, name):
+        """
+        每个适配器类自己的注册表/分派表，子类的注册不影响父类
+        """
+        table = cls.__dict__.get(name)
+        if table is None:
+            table = {}
+            setattr(cls, name, table)
+        return table
+    @classmethod
+    def register(cls, adaptee_type, method_name):
+        cls._own('_registered')[adaptee_type] = method_name
+        classes = [cls]
+        while classes:  # 子类也会用到这一条注册，清空它们的分派表
+            klass = classes.pop()
+            klass._own('_dispatch').clear()
+            classes.extend(klass.__subclasses__())
+    @classmethod
+    def _find(cls, adaptee_type):
+        """
+        返回 (注册所在的适配器类, 注册的适配者类型, 方法名)；适配者类型越具体越优先，同一类型子类适配器的注册优先
+        """
+        for klass in adaptee_type.__mro__:
+            for adapter_class in cls.__mro__:
+                method_name = adapter_class.__dict__.get('_registered', {}).get(klass)
+                if method_name is not None:
+                    return adapter_class, klass, method_name
+        raise TypeError('no adapter registered for %s' % adaptee_type.__name__)
+    @classmethod
+    def _resolve(cls, adaptee_type):
+        method_name = cls._find(adaptee_type)[2]
+        method = cls._own('_dispatch')[adaptee_type] = getattr(adaptee_type, method_name)
+        return method
+    def __init__(self, adaptee):
+        self.__dict__['_adaptee'] = adaptee  # 新的实例没有缓存，不经过 adaptee 的 setter
+    @property
+    def adaptee(self):
+        return self.__dict__['_adaptee']
+    @adaptee.setter
+    def adaptee(self, adaptee):
+        self.invalidate()  # 缓存的是旧适配者的绑定方法
+        self.__dict__['_adaptee'] = adaptee
+    def __getattr__(self, attr):
+        try:
+            adaptee = self.__dict__['_adaptee']
+        except KeyError:  # 还没有设置适配者(如 copy、pickle 创建的空实例)
+            raise AttributeError(attr)
+        value = getattr(adaptee, attr)
+        if callable(value) and attr not in getattr(adaptee, '__dict__', ()) and hasattr(adaptee.__class__, attr):
+            self.__dict__[attr] = value
+            self.__dict__.setdefault('_forwarded', set()).add(attr)
+        return value
+    def invalidate(self, attr=None):
+        forwarded = self.__dict__.get('_forwarded', set())
+        for name in list(forwarded) if attr is None else [attr] if attr in forwarded else []:
+            forwarded.discard(name)
+            del self.__dict__[name]
+    def make_noise(self):
+        adaptee = self._adaptee
+        try:
+            method = self._dispatch[adaptee.__class__]
+        except KeyError:
+            method = self._resolve(adaptee.__class__)
+        return method(adaptee)
+    @classmethod
+    def make_noise_many(cls, adaptees, chunksize=1024):
+        """
+        批量适配: 不为每个适配者创建适配器，按输入顺序逐个产出结果
+        每次从输入中读取 chunksize 个适配者，按类型分组后，对每组在一个紧凑的循环中调用该类型的适配者方法，
+        内存占用只与 chunksize 有关，可以处理流式的输入。
+        """
+        adaptees = iter(adaptees)
+        dispatch = cls._own('_dispatch')
+        while True:
+            chunk = list(itertools.islice(adaptees, chunksize))
+            if not chunk:
+                return
+            groups = {}
+            for index, adaptee in enumerate(chunk):
+                adaptee_type = adaptee.__class__
+                group = groups.get(adaptee_type)
+                if group is None:
+                    group = groups[adaptee_type] = []
+                group.append(index)
+            results = [None] * len(chunk)
+            for adaptee_type, indexes in groups.iteritems():
+                method = dispatch.get(adaptee_type) or cls._resolve(adaptee_type)
+                for index in indexes:
+                    results[index] = method(chunk[index])
+            for result in results:
+                yield result
+
+Adapter_cached.register(Cat, 'meow')
+Adapter_cached.register(Dog, 'bark')
+Adapter_cached.register(Human, 'speak')
+
+
+animals = [Adapter_cached(cat), Adapter_cached(dog), Adapter_cached(human)]
+for animal in animals:
+    print animal.name, animal.make_noise()
+
+# Cat meow ~
+# Dog woof !
+# Human hello ?
+
+tom = Cat()
+adapter = Adapter_cached(tom)
+print adapter.name, adapter.meow is adapter.meow
+# Cat True
+tom.name = 'Tom'  # 数据属性不缓存，读到的始终是最新的值
+print adapter.name
+# Tom
+meow = adapter.meow
+adapter.adaptee = Cat()  # 更换适配者时清除缓存的方法
+print meow.__self__ is tom, adapter.meow.__self__ is adapter.adaptee
+# True True
+
+
+class Adapter_chain(Target):
+    """
+    适配器类: 依次执行 isinstance 判断，与 Adapter.make_noise 的判断链成本相同，用于对比
+    """
+    chain = []
+    def __init__(self, adaptee):
+        self.adaptee = adaptee
+    def __getattr__(self, attr):
+        return getattr(self.adaptee, attr)
+    def make_noise(self):
+        for adaptee_type, method_name in self.chain:
+            if isinstance(self.adaptee, adaptee_type):
+                return getattr(self.adaptee, method_name)()
+
+def make_adaptee_types(n):
+    adaptee_types = [(Cat, 'meow'), (Dog, 'bark'), (Human, 'speak')]
+    for i in xrange(3, n):
+        method_name = 'noise_%d' % i
+        adaptee_type = type('Animal_%d' % i, (object,), {
+            '__init__': lambda self: setattr(self, 'name', self.__class__.__name__),
+            method_name: lambda self: '...',
+        })
+        adaptee_types.append((adaptee_type, method_name))
+    return adaptee_types
+
+def bench_adapter(n_types, n_calls=100000):
+    adaptee_types = make_adaptee_types(n_types)
+    Adapter_chain.chain = adaptee_types
+    for adaptee_type, method_name in adaptee_types:
+        Adapter_cached.register(adaptee_type, method_name)
+    adaptees = [adaptee_types[i % n_types][0]() for i in xrange(n_calls)]
+    method_names = dict(adaptee_types)
+    results = []
+    for adapter_class in (Adapter_chain, Adapter_cached):
+        adapters = [adapter_class(adaptee) for adaptee in adaptees]
+        start = time.time()
+        for adapter in adapters:
+            adapter.make_noise()
+        t_noise = time.time() - start
+        start = time.time()
+        for adapter in adapters:
+            for _ in xrange(10):
+                adapter.name
+        t_data = time.time() - start
+        pairs = [(adapter, method_names[adapter.adaptee.__class__]) for adapter in adapters]
+        start = time.time()
+        for adapter, method_name in pairs:
+            for _ in xrange(10):
+                getattr(adapter, method_name)
+        t_method = time.time() - start
+        results.append('%s make_noise=%.0f/s data attr=%.0f/s method attr=%.0f/s' % (
+            adapter_class.__name__, n_calls / t_noise, 10 * n_calls / t_data, 10 * n_calls / t_method))
+    print 'types=%-3d' % n_types, '\n          '.join(results)
+
+for n_types in (3, 50):
+    bench_adapter(n_types)
+# types=3   Adapter_chain make_noise=781420/s data attr=949572/s method attr=839435/s
+#           Adapter_cached make_noise=1569636/s data attr=1018258/s method attr=1579063/s
+# types=50  Adapter_chain make_noise=128295/s data attr=1067173/s method attr=994789/s
+#           Adapter_cached make_noise=1447555/s data attr=814748/s method attr=1758486/s
+# 每个适配器访问 10 次；数据属性每次都转发，与 Adapter_chain 相当，方法在第一次访问后直接从 __dict__ 中读取
+
+
+print list(Adapter_cached.make_noise_many([cat, dog, human, cat]))
+# ['meow ~', 'woof !', 'hello ?', 'meow ~']
+
+def adaptee_stream(n):
+    adaptees = (cat, dog, human)
+    for i in xrange(n):
+        yield adaptees[i % 3]
+
+n = 300000
+start = time.time()
+for noise in (Adapter_cached(adaptee).make_noise() for adaptee in adaptee_stream(n)):
+    pass
+t_wrapped = time.time() - start
+start = time.time()
+for noise in Adapter_cached.make_noise_many(adaptee_stream(n)):
+    pass
+t_bulk = time.time() - start
+print 'n=%d per-item adapter=%.0f/s bulk=%.0f/s' % (n, n / t_wrapped, n / t_bulk)
+# n=300000 per-item adapter=772577/s bulk=1336130/s
+
+
+"""
+异步适配器
+    适配者的方法(meow、bark 等)是阻塞调用，而 Target.make_noise 是同步的，在异步的服务中直接调用会阻塞调用者；
+    异步适配器的 make_noise 把阻塞的适配者方法提交到一个有界的线程池中执行，立即返回 AsyncResult(future)，通过 get() 获取结果；
+    方法本身已经是非阻塞的适配者(注册时 blocking=False，方法返回 AsyncResult)，直接调用，不再经过线程池，
+    是否阻塞与适配者方法一起沿 MRO 查找，注册类型的子类沿用注册时的设置；
+    执行器限制同时在途(排队和执行中)的调用个数，非阻塞调用同样计入，达到上限时 make_noise 等待，
+    并统计排队(包括等待名额的时间)和执行的耗时。
+原需求基于 asyncio，本仓库的示例运行在 Python 2 上，这里以线程池 + AsyncResult 实现。
+"""
+
+class Noise_executor(object):
+    """
+    有界执行器
+    """
+    def __init__(self, max_workers=4, max_in_flight=16):
+        self.pool = multiprocessing.pool.ThreadPool(max_workers)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._watched = []
+        self._watcher = None
+        self.count = 0
+        self.wait_total = self.wait_max = 0.0
+        self.run_total = self.run_max = 0.0
+    def submit(self, func, *args):
+        submitted = time.time()
+        self._in_flight.acquire()
+        return self.pool.apply_async(self._run, (func, args, submitted))
+    def _run(self, func, args, submitted):
+        started = time.time()
+        try:
+            return func(*args)
+        finally:
+            self._in_flight.release()
+            self._record(started - submitted, time.time() - started)
+    def track(self, func, *args):
+        """
+        非阻塞调用: 在调用者线程中直接调用 func，返回它的 AsyncResult，
+        同样占用一个在途名额，由监视线程在结果完成时释放名额并记录耗时
+        """
+        submitted = time.time()
+        self._in_flight.acquire()
+        started = time.time()
+        try:
+            result = func(*args)
+        except:
+            self._in_flight.release()
+            raise
+        with self._lock:
+            self._watched.append((result, started - submitted, started))
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch)
+                self._watcher.daemon = True
+                self._watcher.start()
+        return result
+    def _watch(self):
+        while True:
+            with self._lock:
+                if not self._watched:
+                    self._watcher = None
+                    return
+                done = [item for item in self._watched if item[0].ready()]
+                self._watched = [item for item in self._watched if item not in done]
+            for result, wait, started in done:
+                self._in_flight.release()
+                self._record(wait, time.time() - started)
+            time.sleep(0.001)
+    def _record(self, wait, run):
+        with self._lock:
+            self.count += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.run_total += run
+            self.run_max = max(self.run_max, run)
+    def stats(self):
+        with self._lock:
+            count = self.count or 1
+            return 'calls=%d wait(avg/max)=%.3f/%.3fs run(avg/max)=%.3f/%.3fs' % (
+                self.count, self.wait_total / count, self.wait_max, self.run_total / count, self.run_max)
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+class Adapter_async(Adapter_cached):
+    """
+    适配器类
+    """
+    _nonblocking = {}  # 注册为非阻塞的适配者类型
+    _async_dispatch = {}
+    @classmethod
+    def register(cls, adaptee_type, method_name, blocking=True):
+        super(Adapter_async, cls).register(adaptee_type, method_name)
+        nonblocking = cls._own('_nonblocking')
+        if blocking:
+            nonblocking.pop(adaptee_type, None)
+        else:
+            nonblocking[adaptee_type] = True
+    @classmethod
+    def _resolve_async(cls, adaptee_type):
+        adapter_class, klass, _ = cls._find(adaptee_type)
+        blocking = klass not in adapter_class.__dict__.get('_nonblocking', {})
+        entry = cls._own('_async_dispatch')[adaptee_type] = (cls._resolve(adaptee_type), blocking)
+        return entry
+    def __init__(self, adaptee, executor):
+        super(Adapter_async, self).__init__(adaptee)
+        self.executor = executor
+    def make_noise(self):
+        adaptee = self._adaptee
+        adaptee_type = adaptee.__class__
+        entry = self._async_dispatch.get(adaptee_type)
+        if entry is None or self._dispatch.get(adaptee_type) is not entry[0]:
+            entry = self._resolve_async(adaptee_type)  # register 会清空 _dispatch，据此判断缓存是否过期
+        method, blocking = entry
+        if blocking:
+            return self.executor.submit(method, adaptee)
+        return self.executor.track(method, adaptee)
+
+class Cat_remote(Cat):
+    """
+    适配者类: 阻塞调用
+    """
+    def meow(self):
+        time.sleep(0.1)
+        return 'remote meow ~'
+
+class Robot(object):
+    """
+    适配者类: 非阻塞调用，返回 AsyncResult
+    """
+    def __init__(self, pool):
+        self.name = self.__class__.__name__
+        self.pool = pool
+    def beep(self):
+        return self.pool.apply_async(str, ('beep #',))
+
+
+class Robot_v2(Robot):
+    """
+    适配者类: 未单独注册，沿用 Robot 的注册
+    """
+    pass
+
+
+executor = Noise_executor(max_workers=4, max_in_flight=8)
+Adapter_async.register(Robot, 'beep', blocking=False)
+adaptees = [Cat_remote() for _ in xrange(8)] + [Robot(executor.pool), Robot_v2(executor.pool)]
+start = time.time()
+futures = [(adaptee.name, Adapter_async(adaptee, executor).make_noise()) for adaptee in adaptees]
+print 'submitted in %.3fs' % (time.time() - start)
+# submitted in 0.101s
+# 在途上限为 8，两个 Robot 的调用等到第一批 Cat_remote 完成后才能提交
+print sorted(set((name, future.get(timeout=10)) for name, future in futures))
+# [('Cat_remote', 'remote meow ~'), ('Robot', 'beep #'), ('Robot_v2', 'beep #')]
+time.sleep(0.01)  # 等待监视线程记录非阻塞调用
+print 'finished in %.1fs' % (time.time() - start), executor.stats()
+# finished in 0.2s calls=10 wait(avg/max)=0.050/0.101s run(avg/max)=0.100/0.101s
+adapter = Adapter_async(Robot_v2(executor.pool), executor)
+adapter.beep
+adapter.invalidate()
+print adapter.make_noise().get(timeout=10), adapter.executor is executor
+# beep # True
+print Robot in Adapter_async._registered, Robot in Adapter_cached._registered  # 各个适配器类的注册互不影响
+# True False
+executor.close()
@@ -36,6 +36,16 @@
 桥接模式是一种对象结构型模式，又称为柄体(Handle and Body)模式或接口(Interface)模式。
 """
 
+import Queue
+import cPickle
+import collections
+import itertools
+import multiprocessing
+import sys
+import thread
+import threading
+import time
+
 class PhoneBrand(object):
     """
     抽象类
@@ -88,3 +98,324 @@ func_b = PhoneFunc_Sms()
 phone_ios.set_func(func_b)
 phone_ios.work()
 # PhoneFunc_Sms run SMS
+
+
+"""
+无锁热切换实现类的桥接(RCU: Read-Copy-Update)
+    PhoneBrand.set_func 在其他线程正在执行 work() 时替换实现类，无法保证并发的读者看到哪一个实现类，
+    也无法知道旧的实现类什么时候不再被使用，从而安全地释放它(关闭连接等)。
+    读者: 不加锁，读取一个不可变的快照 (版本号, 实现类)，并在自己线程的槽位中登记正在使用的版本号，调用结束后清除登记；
+    写者: 原子地替换快照，然后等待所有登记了旧版本号的读者结束(宽限期)，再调用旧实现类的 retire() 将其退役。
+写者之间用锁串行化，读者始终不加锁。
+"""
+
+class PhoneBrand_rcu(PhoneBrand):
+    """
+    扩充抽象类
+    """
+    def __init__(self):
+        self._snapshot = (0, None)
+        self._readers = {}  # 线程 id -> 正在使用的版本号
+        self._writer_lock = threading.Lock()
+    @property
+    def func(self):
+        return self._snapshot[1]
+    def set_func(self, func):
+        with self._writer_lock:
+            generation, old_func = self._snapshot
+            self._snapshot = (generation + 1, func)
+            while any(g is not None and g <= generation for g in self._readers.values()):
+                time.sleep(0.0001)
+        if old_func is not None and hasattr(old_func, 'retire'):
+            old_func.retire()
+    def work(self):
+        readers = self._readers
+        tid = thread.get_ident()
+        while True:
+            snapshot = self._snapshot
+            readers[tid] = snapshot[0]
+            if self._snapshot is snapshot:  # 登记之后快照没有被替换，写者一定能看到这次登记
+                break
+        try:
+            if snapshot[1] is not None:
+                snapshot[1].run()
+        finally:
+            readers[tid] = None
+
+
+phone_rcu = PhoneBrand_rcu()
+phone_rcu.set_func(func_a)
+phone_rcu.work()
+# PhoneFunc_Call run CALL
+phone_rcu.set_func(func_b)
+phone_rcu.work()
+# PhoneFunc_Sms run SMS
+
+
+class PhoneFunc_Counting(PhoneFunc):
+    """
+    具体实现类: 退役后仍被调用时记录一次违规
+    """
+    violations = 0
+    def __init__(self):
+        self.retired = False
+    def run(self):
+        sum(xrange(100))
+        if self.retired:
+            PhoneFunc_Counting.violations += 1
+    def retire(self):
+        self.retired = True
+
+def bench_swap(phone, n_readers=4, duration=1.0, swap_interval=0.001):
+    PhoneFunc_Counting.violations = 0
+    phone.set_func(PhoneFunc_Counting())
+    stop = threading.Event()
+    reads = [0] * n_readers
+    def reader(i):
+        while not stop.is_set():
+            phone.work()
+            reads[i] += 1
+    threads = [threading.Thread(target=reader, args=(i,)) for i in xrange(n_readers)]
+    for t in threads:
+        t.start()
+    swaps = 0
+    start = time.time()
+    while time.time() - start < duration:
+        old_func = phone.func
+        phone.set_func(PhoneFunc_Counting())
+        if not isinstance(phone, PhoneBrand_rcu):
+            old_func.retire()  # 普通桥接: 替换后立即退役旧的实现类
+        swaps += 1
+        time.sleep(swap_interval)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    print '%-16s reads/sec=%.0f swaps/sec=%.0f retired-while-running=%d' % (
+        phone.__class__.__name__, sum(reads) / elapsed, swaps / elapsed, PhoneFunc_Counting.violations)
+
+bench_swap(PhoneBrand_ios())
+bench_swap(PhoneBrand_rcu())
+# PhoneBrand_ios   reads/sec=457939 swaps/sec=190 retired-while-running=71
+# PhoneBrand_rcu   reads/sec=394397 swaps/sec=65 retired-while-running=0
+
+
+"""
+进程外的实现类
+    桥接模式让实现类可以独立变化，但 PhoneFunc.run 总是在当前进程中执行，计算量大的实现类无法利用多核；
+    PhoneFunc_remote 本身也是一个实现类，它把 run() 通过管道(multiprocessing.Pipe)转发给若干个工作进程中的真正实现类执行，PhoneBrand 的代码不需要任何修改:
+        每个工作进程一条连接，连接放在连接池中，并发的 run() 各自从池中取出一条连接；
+        run_many(calls) 占用所有空闲的连接，在每条连接上连续发送多个请求(流水线)，不必等待上一个请求的响应，再按顺序收集结果；
+        连接上尚未收到响应的请求不超过 _PIPE_SAFE_BYTES 字节时直接发送；超过时发送可能阻塞，
+        此时在另一个线程中发送，同时读取已经到达的响应，避免两端都阻塞在发送上；
+        每个请求的发送和接收都有超时，超时抛出 multiprocessing.TimeoutError，超时请求迟到的响应按请求 id 丢弃，
+        发送超时的连接上只写入了部分请求，换用一个新的工作进程。
+实现类需要能够传给工作进程，run() 的参数和返回值需要能够被 pickle。
+"""
+
+_PIPE_SAFE_BYTES = 32 * 1024  # 远小于管道的缓冲区
+
+def _phone_func_worker(func, conn):
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        request_id, args = request
+        try:
+            response = (request_id, True, func.run(*args))
+        except Exception as e:
+            response = (request_id, False, e)
+        sys.stdout.flush()
+        conn.send(response)
+
+class PhoneFunc_remote(PhoneFunc):
+    """
+    具体实现类: 转发给工作进程中的实现类
+    """
+    def __init__(self, func, n_workers=2, timeout=5.0, max_pipelined=32):
+        self.func = func
+        self.timeout = timeout
+        self.max_pipelined = max_pipelined
+        self._ids = itertools.count()
+        self._pool = Queue.Queue()
+        self._workers = {}
+        self._unanswered = {}  # 每条连接上已发送、尚未读到响应的请求 id -> 字节数
+        self._broken = set()
+        for _ in xrange(n_workers):
+            self._spawn()
+    def _spawn(self):
+        sys.stdout.flush()  # 避免缓冲区中的内容在工作进程中被重复输出
+        conn, child_conn = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=_phone_func_worker, args=(self.func, child_conn))
+        worker.daemon = True
+        worker.start()
+        child_conn.close()
+        self._workers[conn] = worker
+        self._unanswered[conn] = {}
+        self._pool.put(conn)
+    def _acquire(self):
+        try:
+            return self._pool.get(timeout=self.timeout)
+        except Queue.Empty:
+            raise multiprocessing.TimeoutError('no idle connection after %.3fs' % self.timeout)
+    def _release(self, conn):
+        if conn not in self._broken:
+            self._pool.put(conn)
+            return
+        # 请求只发送了一部分，连接上的数据已不完整，换一个新的工作进程
+        self._broken.discard(conn)
+        worker = self._workers.pop(conn)
+        del self._unanswered[conn]
+        worker.terminate()
+        worker.join()
+        conn.close()
+        self._spawn()
+    def _read(self, conn, received):
+        response = conn.recv()
+        self._unanswered[conn].pop(response[0], None)
+        received[response[0]] = response
+    def _send(self, conn, request_id, args, received, deadline):
+        data = cPickle.dumps((request_id, args), cPickle.HIGHEST_PROTOCOL)
+        unanswered = self._unanswered[conn]
+        in_flight = sum(unanswered.itervalues())
+        unanswered[request_id] = len(data)
+        if in_flight + len(data) <= _PIPE_SAFE_BYTES:
+            conn.send_bytes(data)
+            return
+        # 管道缓冲区可能已满，而工作进程也可能正阻塞在发送响应上:
+        # 在另一个线程中发送，同时读取已经到达的响应，直到发送完成或超时
+        errors = []
+        def send():
+            try:
+                conn.send_bytes(data)
+            except Exception:
+                errors.append(sys.exc_info())
+        sender = threading.Thread(target=send)
+        sender.daemon = True
+        sender.start()
+        while sender.is_alive():
+            if time.time() >= deadline:
+                self._broken.add(conn)
+                raise multiprocessing.TimeoutError('request not sent after %.3fs' % self.timeout)
+            if conn.poll(0):
+                self._read(conn, received)
+            else:
+                sender.join(0.001)
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+    def _recv(self, conn, request_id, received, deadline):
+        while request_id not in received:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not conn.poll(remaining):
+                raise multiprocessing.TimeoutError('no response after %.3fs' % self.timeout)
+            self._read(conn, received)  # 超时请求迟到的响应按 id 丢弃
+        _, ok, result = received.pop(request_id)
+        if not ok:
+            raise result
+        return result
+    def run(self, *args):
+        conn = self._acquire()
+        try:
+            deadline = time.time() + self.timeout
+            received = {}
+            request_id = next(self._ids)
+            self._send(conn, request_id, args, received, deadline)
+            return self._recv(conn, request_id, received, deadline)
+        finally:
+            self._release(conn)
+    def run_many(self, calls):
+        calls = list(calls)
+        conns = [self._acquire()]
+        while True:
+            try:
+                conns.append(self._pool.get_nowait())
+            except Queue.Empty:
+                break
+        pending = [collections.deque() for _ in conns]
+        received = {}
+        results = [None] * len(calls)
+        try:
+            for index, args in enumerate(calls):
+                conn, queue = conns[index % len(conns)], pending[index % len(conns)]
+                if len(queue) >= self.max_pipelined:
+                    request_id, i = queue.popleft()
+                    results[i] = self._recv(conn, request_id, received, time.time() + self.timeout)
+                request_id = next(self._ids)
+                self._send(conn, request_id, args, received, time.time() + self.timeout)
+                queue.append((request_id, index))
+            for conn, queue in zip(conns, pending):
+                while queue:
+                    request_id, i = queue.popleft()
+                    results[i] = self._recv(conn, request_id, received, time.time() + self.timeout)
+        finally:
+            for conn in conns:
+                self._release(conn)
+        return results
+    def close(self):
+        for conn in self._workers:
+            conn.send(None)
+            conn.close()
+        for worker in self._workers.itervalues():
+            worker.join()
+
+class PhoneFunc_Hash(PhoneFunc):
+    """
+    具体实现类: 计算量大
+    """
+    def run(self, n=200000):
+        return sum(i * i for i in xrange(n))
+
+class PhoneFunc_Slow(PhoneFunc):
+    """
+    具体实现类: 响应慢
+    """
+    def run(self, delay=0.5):
+        time.sleep(delay)
+        return 'slow %s' % delay
+
+class PhoneFunc_Echo(PhoneFunc):
+    """
+    具体实现类: 原样返回参数
+    """
+    def run(self, data=''):
+        return data
+
+
+func_remote = PhoneFunc_remote(PhoneFunc_Call(), n_workers=1)
+phone_ios.set_func(func_remote)
+phone_ios.work()
+# PhoneFunc_Call run CALL
+func_remote.close()
+
+func_remote = PhoneFunc_remote(PhoneFunc_Slow(), n_workers=1, timeout=0.1)
+try:
+    func_remote.run()
+except multiprocessing.TimeoutError as e:
+    print 'TimeoutError:', e
+# TimeoutError: no response after 0.100s
+time.sleep(0.5)
+print func_remote.run(0)  # 超时请求迟到的响应('slow 0.5')被丢弃，得到的是本次请求的响应
+# slow 0
+func_remote.close()
+
+func_remote = PhoneFunc_remote(PhoneFunc_Echo(), n_workers=1, timeout=2.0)
+results = func_remote.run_many([('x' * 2 ** 20,)] * 4)  # 请求和响应都超过管道缓冲区
+print len(results), all(len(result) == 2 ** 20 for result in results)
+# 4 True
+func_remote.close()
+
+n = 64
+start = time.time()
+results_local = [PhoneFunc_Hash().run() for _ in xrange(n)]
+t_local = time.time() - start
+func_remote = PhoneFunc_remote(PhoneFunc_Hash(), n_workers=multiprocessing.cpu_count())
+start = time.time()
+results_remote = func_remote.run_many([()] * n)
+t_remote = time.time() - start
+func_remote.close()
+print 'cpus=%d calls=%d local=%.3fs remote=%.3fs same=%s' % (
+    multiprocessing.cpu_count(), n, t_local, t_remote, results_local == results_remote)
+# cpus=1 calls=64 local=0.807s remote=0.881s same=True
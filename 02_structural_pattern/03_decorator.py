@@ -40,12 +40,25 @@
 根据翻译的不同，装饰模式也有人称之为“油漆工模式”，它是一种对象结构型模式。
 """
 
+import bisect
+import collections
+import json
+import threading
+import time
+
 class Person(object):
     """
     抽象构件
     """
     def display(self):
         pass
+    def state_key(self):
+        """
+        影响 display() 结果的状态，缓存装饰器用它判断构件是否发生了变化
+        默认只取 __dict__ 中的属性值(浅比较): 只能发现属性被重新赋值，属性所引用对象内部的修改无法发现，
+        display() 依赖嵌套对象的内容时，子类需要重写 state_key，返回这部分内容(或一个版本号)
+        """
+        return tuple(sorted((k, v) for k, v in self.__dict__.iteritems() if k != 'component'))
 
 class Man(Person):
     """
@@ -60,26 +73,33 @@ class Superhero(Person):
     """
     抽象装饰类
     """
+    template = None  # 包装被装饰构件输出的模板，只含一个 %s；为 None 时子类需要自定义 behave()
     def __init__(self):
         self.component = None
     def decorate(self, component):
         self.component = component
     def behave(self):
-        pass
+        """
+        按 template 包装被装饰构件的输出
+        """
+        return self.template % self.component.display()
+    def display(self):
+        """
+        装饰器本身也是构件，可以被其他装饰器继续装饰
+        """
+        return self.behave()
 
 class Batman(Superhero):
     """
     具体装饰类
     """
-    def behave(self):
-        return '^^^(B) [%s] (B)^^^' % self.component.display()
+    template = '^^^(B) [%s] (B)^^^'
 
 class Superman(Superhero):
     """
     具体装饰类
     """
-    def behave(self):
-        return '<<<(S) [%s] (S)>>>' % self.component.display()
+    template = '<<<(S) [%s] (S)>>>'
 
 
 bruce = Man('Bruce')
@@ -93,3 +113,397 @@ superman = Superman()
 superman.decorate(clark)
 print superman.behave()
 # <<<(S) [Clark] (S)>>>
+
+
+"""
+展开(融合)的装饰器栈
+    多层装饰时，每一层的 behave() 都要调用下一层的 display()，调用一次最外层，每一层都要付出一次(或两次)函数调用的开销；
+    装饰器栈管理一个具体构件和它外面的各层装饰器，第一次调用时把整个栈编译成一个融合的函数:
+        声明了 template 且沿用 Superhero.behave 的各层合并为一个前缀和一个后缀，调用时只需要一次字符串拼接；
+        自定义了 behave 的层(即使继承了 template)，它及其下方的各层仍按原来的方式逐层调用，只有它上方的各层被合并；
+    通过 push/remove 增加或移除一层时，融合的函数失效，下次调用时重新编译。
+"""
+
+_template_mark = '\x00'
+
+class Decorator_stack(Person):
+    """
+    装饰器栈
+    """
+    def __init__(self, component):
+        self.component = component
+        self.layers = []  # 由内到外
+        self._fused = None
+    def state_key(self):
+        return tuple((layer.__class__, layer.state_key()) for layer in self.layers)
+    def _relink(self):
+        component = self.component
+        for layer in self.layers:
+            layer.decorate(component)
+            component = layer
+        self._fused = None
+    def push(self, layer):
+        self.layers.append(layer)
+        self._relink()
+        return self
+    def remove(self, layer):
+        self.layers.remove(layer)
+        self._relink()
+        return self
+    def _compile(self):
+        base = self.component.display
+        prefix = suffix = ''
+        for layer in self.layers:
+            if layer.template is None or type(layer).behave.im_func is not Superhero.behave.im_func:
+                base = layer.behave  # 无法融合的层: 它及其下方各层仍逐层调用
+                prefix = suffix = ''
+            else:
+                layer_prefix, layer_suffix = (layer.template % _template_mark).split(_template_mark)
+                prefix = layer_prefix + prefix
+                suffix = suffix + layer_suffix
+        if not prefix and not suffix:
+            return base
+        return lambda: prefix + base() + suffix
+    def display(self):
+        fused = self._fused
+        if fused is None:
+            fused = self._fused = self._compile()
+        return fused()
+
+
+stack = Decorator_stack(Man('Bruce')).push(Batman()).push(Superman())
+print stack.display(), stack.layers[-1].behave()
+# <<<(S) [^^^(B) [Bruce] (B)^^^] (S)>>> <<<(S) [^^^(B) [Bruce] (B)^^^] (S)>>>
+stack.remove(stack.layers[0])
+print stack.display()
+# <<<(S) [Bruce] (S)>>>
+
+class Batman_loud(Batman):
+    """
+    具体装饰类: 继承了 template，但自定义了 behave
+    """
+    def behave(self):
+        return 'LOUD ' + super(Batman_loud, self).behave()
+
+
+stack = Decorator_stack(Man('Bruce')).push(Batman_loud()).push(Superman())
+assert stack.display() == stack.layers[-1].behave()
+print stack.display()
+# <<<(S) [LOUD ^^^(B) [Bruce] (B)^^^] (S)>>>
+
+def bench_stack(depth, n_calls=20000):
+    stack = Decorator_stack(Man('Bruce'))
+    for i in xrange(depth):
+        stack.push(Batman() if i % 2 == 0 else Superman())
+    top = stack.layers[-1]
+    assert top.behave() == stack.display()
+    results = []
+    for name, call in (('layered', top.behave), ('fused', stack.display)):
+        start = time.time()
+        for _ in xrange(n_calls):
+            call()
+        results.append('%s=%.2fus' % (name, (time.time() - start) / n_calls * 1e6))
+    print 'depth=%-3d' % depth, ' '.join(results)
+
+for depth in (1, 10, 100):
+    bench_stack(depth)
+# depth=1   layered=0.52us fused=0.38us
+# depth=10  layered=4.10us fused=0.38us
+# depth=100 layered=68.56us fused=0.61us
+
+
+"""
+缓存装饰器
+    Batman.behave、Superman.behave 每次调用都要重新调用 component.display() 计算结果，即使被装饰的构件没有任何变化；
+    缓存装饰器可以插入到装饰链的任意位置，它的 behave()/display() 返回下方构件 display() 的结果，并以下方整条装饰链的状态(state_key)为 key 缓存:
+        构件的状态改变后 key 随之改变，自动重新计算；也可以调用 invalidate() 清空缓存；
+        默认的 state_key 只能发现属性被重新赋值(如 man.name = ...)，修改属性引用的对象内部(如 man.suit.color = ...)不会改变 key，
+        这样的构件需要重写 state_key；
+        maxsize 限制缓存条目数，超出时按 LRU 淘汰；ttl 不为 None 时，缓存条目超过 ttl 秒后过期；
+        hits/misses/evictions/expirations 统计缓存的使用情况；
+        状态中有不可哈希的值(如 list)时无法缓存，每次都直接调用下方构件，单独计入 uncacheable，
+        这样的构件应当重写 state_key，返回可哈希的状态(如 Decorator_stack)；
+        缓存的读写在锁内进行，可以在多个线程中并发调用。
+缓存装饰器没有 template，在装饰器栈中它上方的各层仍可以被融合。
+"""
+
+class Superhero_cached(Superhero):
+    """
+    具体装饰类: 缓存
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        super(Superhero_cached, self).__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.uncacheable = 0
+    def state_key(self):
+        return ()  # 缓存本身不影响输出
+    def _key(self):
+        key = []
+        component = self.component
+        while component is not None:
+            key.append((component.__class__, component.state_key()))
+            component = getattr(component, 'component', None)
+        return tuple(key)
+    def behave(self):
+        key = self._key()
+        try:
+            hash(key)
+        except TypeError:  # 状态中有不可哈希的值，无法缓存
+            with self._lock:
+                self.uncacheable += 1
+            return self.component.display()
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.time():
+                    self._cache[key] = entry  # 重新插入到末尾，即最近使用
+                    self.hits += 1
+                    return value
+                self.expirations += 1
+            self.misses += 1
+        value = self.component.display()  # 在锁外计算，不阻塞其他线程的命中
+        with self._lock:
+            self._cache[key] = (value, time.time() + self.ttl if self.ttl is not None else None)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return value
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'uncacheable': self.uncacheable, 'size': len(self._cache)}
+
+class Man_slow(Man):
+    """
+    具体构件: display() 计算成本高
+    """
+    def display(self):
+        time.sleep(0.01)
+        return self.name
+
+
+bruce = Man_slow('Bruce')
+cached = Superhero_cached(maxsize=2, ttl=0.05)
+stack = Decorator_stack(bruce).push(cached).push(Batman())
+print stack.display(), stack.display()
+# ^^^(B) [Bruce] (B)^^^ ^^^(B) [Bruce] (B)^^^
+bruce.name = 'Bruce Wayne'  # 构件状态改变，缓存的 key 随之改变
+print stack.display()
+# ^^^(B) [Bruce Wayne] (B)^^^
+time.sleep(0.05)  # 超过 ttl，缓存过期
+stack.display()
+print cached.stats()
+# {'hits': 1, 'expirations': 1, 'evictions': 0, 'misses': 3, 'uncacheable': 0, 'size': 2}
+
+start = time.time()
+for _ in xrange(100):
+    stack.display()
+print '100 calls in %.3fs' % (time.time() - start)
+# 100 calls in 0.001s
+
+cached = Superhero_cached()
+cached.decorate(Decorator_stack(Man_slow('Clark')).push(Superman()))  # Decorator_stack 重写了 state_key，可以缓存
+threads = [threading.Thread(target=cached.behave) for _ in xrange(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print cached.behave(), cached.stats()
+# <<<(S) [Clark] (S)>>> {'hits': 1, 'expirations': 0, 'evictions': 0, 'misses': 8, 'uncacheable': 0, 'size': 1}
+# 8 个线程同时未命中，各自计算一次；之后的调用命中
+
+clark = Man_slow('Clark')
+clark.aliases = ['Superman']  # list 不可哈希，无法缓存
+cached = Superhero_cached()
+cached.decorate(clark)
+cached.behave()
+print cached.stats()
+# {'hits': 0, 'expirations': 0, 'evictions': 0, 'misses': 0, 'uncacheable': 1, 'size': 0}
+
+class Suit(object):
+    def __init__(self, color):
+        self.color = color
+
+class Man_suited(Man):
+    """
+    具体构件: display() 依赖嵌套对象 suit 的内容
+    """
+    def __init__(self, name=None, suit=None):
+        super(Man_suited, self).__init__(name)
+        self.suit = suit
+    def display(self):
+        return '%s in %s' % (self.name, self.suit.color)
+    def state_key(self):
+        return (self.name, self.suit.color)  # 默认的 state_key 只比较 suit 对象本身，发现不了 color 的修改
+
+
+clark = Man_suited('Clark', Suit('blue'))
+cached = Superhero_cached()
+cached.decorate(clark)
+print cached.behave(),
+clark.suit.color = 'black'
+print cached.behave()
+# Clark in blue Clark in black
+
+
+"""
+分层耗时统计装饰器
+    装饰后的 Person 很慢时，无法知道是哪一层 Superhero 导致的；
+    统计装饰器可以插入到装饰链的任意位置，它统计紧挨在它下方的那一层(及其下方整条链)的调用次数和耗时:
+        inclusive 包含时间: 这一层 display() 的总耗时；
+        exclusive 独占时间: 包含时间减去下方其他统计装饰器统计到的包含时间，即这一层(到下一个统计点之间)自身的耗时；
+    耗时按 2 的幂次分桶记录为直方图，保存在进程内的 Metrics_registry 中，可以输出为文本或 JSON；
+    registry.enabled 为 False 时，统计装饰器只多一次属性判断，直接调用下方的构件。
+"""
+
+class Histogram(object):
+    """
+    直方图: 按 2 的幂次(微秒)分桶
+    """
+    bounds = [2 ** i for i in xrange(21)]  # 1us ~ 1s
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+    def record(self, seconds):
+        self.buckets[bisect.bisect_left(self.bounds, seconds * 1e6)] += 1
+        self.count += 1
+        self.total += seconds
+    def to_dict(self):
+        labels = ['<=%dus' % bound for bound in self.bounds] + ['>%dus' % self.bounds[-1]]
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count * 1e6 if self.count else 0.0,
+            'buckets': dict((label, n) for label, n in zip(labels, self.buckets) if n),
+        }
+
+class Metrics_registry(object):
+    """
+    进程内的统计注册表
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    def record(self, name, inclusive, exclusive):
+        with self._lock:
+            metrics = self._metrics.get(name)
+            if metrics is None:
+                metrics = self._metrics[name] = {'inclusive': Histogram(), 'exclusive': Histogram()}
+            metrics['inclusive'].record(inclusive)
+            metrics['exclusive'].record(exclusive)
+    def child_times(self):
+        """
+        当前线程中各层统计装饰器下方的包含时间累加器(栈)
+        """
+        try:
+            return self._local.child_times
+        except AttributeError:
+            child_times = self._local.child_times = []
+            return child_times
+    def to_dict(self):
+        with self._lock:
+            return dict((name, {'inclusive': metrics['inclusive'].to_dict(), 'exclusive': metrics['exclusive'].to_dict()})
+                        for name, metrics in self._metrics.iteritems())
+    def dump_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+    def dump_text(self):
+        lines = []
+        for name, metrics in sorted(self.to_dict().iteritems()):
+            for kind in ('inclusive', 'exclusive'):
+                histogram = metrics[kind]
+                lines.append('%s %s count=%d mean=%.1fus %s' % (
+                    name, kind, histogram['count'], histogram['mean_us'],
+                    ' '.join('%s:%d' % (label, histogram['buckets'][label])
+                             for label in sorted(histogram['buckets'], key=lambda label: int(label.strip('<=>us'))))))
+        return '\n'.join(lines)
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+metrics_registry = Metrics_registry(enabled=False)
+
+class Superhero_instrumented(Superhero):
+    """
+    具体装饰类: 统计下方那一层的耗时
+    """
+    def __init__(self, name=None, registry=metrics_registry):
+        super(Superhero_instrumented, self).__init__()
+        self.name = name
+        self.registry = registry
+    def state_key(self):
+        return ()  # 统计本身不影响输出
+    def behave(self):
+        registry = self.registry
+        if not registry.enabled:
+            return self.component.display()
+        child_times = registry.child_times()
+        child_times.append(0.0)
+        start = time.time()
+        try:
+            return self.component.display()
+        finally:
+            inclusive = time.time() - start
+            exclusive = inclusive - child_times.pop()
+            if child_times:
+                child_times[-1] += inclusive
+            registry.record(self.name or self.component.__class__.__name__, inclusive, exclusive)
+
+class Superman_slow(Superman):
+    """
+    具体装饰类: 这一层很慢
+    """
+    def behave(self):
+        time.sleep(0.002)
+        return super(Superman_slow, self).behave()
+
+
+stack = Decorator_stack(Man_slow('Clark'))
+stack.push(Superhero_instrumented('Man_slow'))
+stack.push(Superman_slow()).push(Superhero_instrumented('Superman_slow'))
+stack.push(Batman()).push(Superhero_instrumented('Batman'))
+metrics_registry.enabled = True
+for _ in xrange(10):
+    stack.display()
+metrics_registry.enabled = False
+print stack.display()
+# ^^^(B) [<<<(S) [Clark] (S)>>>] (B)^^^
+print metrics_registry.dump_text()
+# Batman inclusive count=10 mean=12897.0us <=16384us:9 <=32768us:1
+# Batman exclusive count=10 mean=17.2us <=16us:5 <=32us:5
+# Man_slow inclusive count=10 mean=10163.2us <=16384us:10
+# Man_slow exclusive count=10 mean=10163.2us <=16384us:10
+# Superman_slow inclusive count=10 mean=12879.8us <=16384us:9 <=32768us:1
+# Superman_slow exclusive count=10 mean=2716.6us <=4096us:9 <=8192us:1
+print metrics_registry.dump_json()
+
+def bench_overhead(n_calls=100000):
+    plain = Decorator_stack(Man('Bruce')).push(Batman()).push(Superman())
+    instrumented = Decorator_stack(Man('Bruce')).push(Batman()).push(Superhero_instrumented()).push(Superman())
+    results = []
+    for name, stack, enabled in (('plain', plain, False),
+                                 ('disabled', instrumented, False),
+                                 ('enabled', instrumented, True)):
+        metrics_registry.enabled = enabled
+        behave = stack.layers[-1].behave  # 逐层调用，不经过融合
+        start = time.time()
+        for _ in xrange(n_calls):
+            behave()
+        results.append('%s=%.2fus' % (name, (time.time() - start) / n_calls * 1e6))
+    metrics_registry.enabled = False
+    print 'per call', ' '.join(results)
+
+bench_overhead()
+# per call plain=1.12us disabled=1.44us enabled=6.17us